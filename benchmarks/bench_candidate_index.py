@@ -0,0 +1,64 @@
+"""Benchmark approximate matching with the `CandidateIndex` of `fintulib.wrangle.FuzzyMatcher`
+against exact matching: recall of the exact top n matches and speed for several settings.
+
+Usage:
+    python benchmarks/bench_candidate_index.py --lookups 20000 --corpus 500000 --quantiles 0.3 0.5 0.7
+    python benchmarks/bench_candidate_index.py --n-features 1048576
+"""
+import argparse
+import time
+
+import numpy as np
+
+from bench_cossim_top import random_names
+from fintulib.wrangle.FuzzyMatcher import FuzzyMatcher
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--corpus", type=int, default=200000)
+    parser.add_argument("--top-n", type=int, default=5)
+    parser.add_argument("--quantiles", type=float, nargs="+", default=[0.3, 0.5, 0.7, 0.9])
+    parser.add_argument("--candidates", type=int, nargs="+", default=[20, 50])
+    parser.add_argument("--n-features", type=int, default=None,
+                        help="hash n-grams into this many features instead of using a vocabulary")
+    args = parser.parse_args()
+
+    matcher = FuzzyMatcher(verbose=False, n_features=args.n_features)
+    corpus = random_names(args.corpus, seed=0)
+    matcher.add_corpus(corpus)
+    # lookups are corrupted corpus entries, so there are good matches to find
+    rng = np.random.RandomState(1)
+    lookups = []
+    for i in rng.randint(len(corpus), size=args.lookups):
+        s = list(corpus[i])
+        s[rng.randint(len(s))] = chr(rng.randint(ord("a"), ord("z") + 1))
+        lookups.append("".join(s))
+
+    start = time.perf_counter()
+    exact = matcher.match_against_corpus(lookups, top_n=args.top_n, output="long")
+    exact_seconds = time.perf_counter() - start
+    exact_pairs = set(zip(exact.lookup_idx, exact.match_idx))
+    exact_best = exact.drop_duplicates("lookup_idx")
+    exact_best_pairs = set(zip(exact_best.lookup_idx, exact_best.match_idx))
+    print(f"exact: {exact_seconds:.2f}s")
+
+    print(f"{'quantile':>8} {'cands':>6} {'build s':>8} {'match s':>8} {'speedup':>8} {'recall':>7} {'recall@1':>8}")
+    for quantile in args.quantiles:
+        for n_candidates in args.candidates:
+            start = time.perf_counter()
+            matcher.build_candidate_index(idf_quantile=quantile, n_candidates=n_candidates)
+            build_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            approx = matcher.match_against_corpus(lookups, top_n=args.top_n, output="long", approximate=True)
+            match_seconds = time.perf_counter() - start
+            approx_pairs = set(zip(approx.lookup_idx, approx.match_idx))
+            recall = len(exact_pairs & approx_pairs) / max(len(exact_pairs), 1)
+            recall_best = len(exact_best_pairs & approx_pairs) / max(len(exact_best_pairs), 1)
+            print(f"{quantile:>8.2f} {n_candidates:>6} {build_seconds:>8.2f} {match_seconds:>8.2f} "
+                  f"{exact_seconds / match_seconds:>8.2f} {recall:>7.3f} {recall_best:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
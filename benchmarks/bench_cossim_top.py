@@ -0,0 +1,48 @@
+"""Benchmark the chunked, parallel `cossim_top` engine of `fintulib.wrangle.FuzzyMatcher`
+across core counts.
+
+Usage:
+    python benchmarks/bench_cossim_top.py --lookups 200000 --corpus 500000 --jobs 1 2 4 8
+"""
+import argparse
+import random
+import string
+import time
+
+from fintulib.wrangle.FuzzyMatcher import FuzzyMatcher, cossim_top
+
+
+def random_names(n, seed):
+    rng = random.Random(seed)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(5000)]
+    return [" ".join(rng.choices(words, k=rng.randint(1, 4))) for _ in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lookups", type=int, default=100000)
+    parser.add_argument("--corpus", type=int, default=200000)
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--pool", choices=["processes", "threads"], default="processes")
+    parser.add_argument("--backend", choices=["auto", "sparse_dot_topn", "scipy"], default="auto")
+    args = parser.parse_args()
+
+    matcher = FuzzyMatcher(verbose=False)
+    matcher.add_corpus(random_names(args.corpus, seed=0))
+    lookups_vect = matcher._vectorize(random_names(args.lookups, seed=1))
+
+    print(f"{'n_jobs':>6} {'seconds':>9} {'speedup':>8}")
+    baseline = None
+    for n_jobs in args.jobs:
+        start = time.perf_counter()
+        cossim_top(lookups_vect, matcher.corpus_vect, args.top_n,
+                   n_jobs=n_jobs, chunk_size=args.chunk_size, pool=args.pool, backend=args.backend)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{n_jobs:>6} {elapsed:>9.2f} {baseline / elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
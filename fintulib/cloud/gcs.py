@@ -1,17 +1,58 @@
 """This module contains helpers to upload / download files and python objects to
 Google Cloud Storage.
 
-Python objects are serialized with pickle.
-
-Note that Python objects need to fit in memory if uploaded directly. Otherwise,
-a temporary local file is required.
+Python objects are serialized with pickle, streamed straight into / out of the
+object on Google Cloud Storage, optionally compressed with zstd or lz4. DataFrames
+can be stored as Parquet instead (with pyarrow installed).
 """
 
-from typing import Any, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Iterable, List, Optional, Tuple
+import base64
+import contextlib
+import hashlib
 import io
+import os
 import pickle
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import pandas as pd
+import requests
+from google.api_core import exceptions
 from google.cloud import storage
 from urllib.parse import urlparse
+try:
+    import fcntl
+except ImportError:
+    # without file locks, concurrent processes may download the same object twice but never read partial files
+    fcntl = None
+if TYPE_CHECKING:
+    import pyarrow
+
+# errors after which a transfer is attempted again in the batch functions
+TRANSIENT_ERRORS = (exceptions.TooManyRequests, exceptions.InternalServerError, exceptions.BadGateway,
+                    exceptions.ServiceUnavailable, exceptions.GatewayTimeout,
+                    requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+# seconds to wait before the first retry, doubled for every further retry
+RETRY_BACKOFF = 1.
+# maximum number of objects GCS composes in one request
+COMPOSE_MAX_SOURCES = 32
+# bytes read at a time to compute checksums of local files
+CHECKSUM_BLOCK_SIZE = 8 * 1024 * 1024
+# rows of a DataFrame converted to Arrow and written to Parquet at a time
+PARQUET_CHUNK_ROWS = 1000000
+# leading bytes identifying how an object was serialized
+PARQUET_MAGIC = b"PAR1"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+LZ4_MAGIC = b"\x04\x22\x4d\x18"
+
+_client_lock = threading.Lock()
+_clients = {}
+_buckets = {}
 
 
 def _parse_gcs_path(gcs_path: str) -> Tuple[str, str]:
@@ -24,95 +65,550 @@ def _parse_gcs_path(gcs_path: str) -> Tuple[str, str]:
     return bucket_name, object_name
 
 
-def gcs_upload_object(python_object: Any, gcs_path: str, overwrite: bool = False, verbose: bool = True) -> None:
+def _get_bucket(bucket_name: str, client: Optional[storage.Client] = None) -> storage.Bucket:
+    """Bucket handle of a cached client, created once per process. Pass `client` to use another client,
+    e.g. one with specific credentials or a fake storage backend."""
+    with _client_lock:
+        if client is None:
+            # clients must not be shared with forked processes
+            client = _clients.get(os.getpid())
+            if client is None:
+                client = _clients[os.getpid()] = storage.Client()
+        key = (id(client), bucket_name)
+        bucket = _buckets.get(key)
+        if bucket is None or bucket.client is not client:
+            bucket = _buckets[key] = client.bucket(bucket_name)
+        return bucket
+
+
+def _get_blob(gcs_path: str, client: Optional[storage.Client] = None) -> storage.Blob:
+    bucket_name, object_name = _parse_gcs_path(gcs_path)
+    return _get_bucket(bucket_name, client).blob(object_name)
+
+
+def _with_retries(func: Callable, retries: int, *args, **kwargs) -> Any:
+    """Call `func`, retrying up to `retries` times with exponential backoff on transient errors."""
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except TRANSIENT_ERRORS:
+            if attempt == retries:
+                raise
+            time.sleep(RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def _upload_file(file_name: str, blob: storage.Blob, overwrite: bool) -> None:
+    """Upload a file, using a generation precondition instead of a separate request to check for an existing
+    object."""
+    try:
+        with open(file_name, mode="rb") as f:
+            blob.upload_from_file(f, if_generation_match=None if overwrite else 0)
+    except exceptions.PreconditionFailed:
+        raise FileExistsError(
+            f"File gs://{blob.bucket.name}/{blob.name} already exists. "
+            f"Specify 'overwrite=True' if you want to overwrite.") from None
+
+
+def _download_file(blob: storage.Blob, file_name: str) -> None:
+    """Download a blob to a file, removing the partial file if the download fails."""
+    f = open(file_name, mode="wb")
+    try:
+        with f:
+            blob.download_to_file(f)
+    except BaseException as error:
+        os.remove(file_name)
+        if isinstance(error, exceptions.NotFound):
+            raise FileNotFoundError(f"The file gs://{blob.bucket.name}/{blob.name} doesn't exist") from None
+        raise
+
+
+def _run_many(func: Callable, tasks: List[Tuple], max_workers: int, retries: int, action: str) -> None:
+    """Run `func(*task)` for all tasks on a bounded thread pool and raise if any of them failed."""
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(_with_retries, func, retries, *task) for task in tasks]
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if errors:
+        raise RuntimeError(f"{len(errors)} of {len(tasks)} {action} failed, the first error was: {errors[0]!r}") \
+            from errors[0]
+
+
+def gcs_upload_object(python_object: Any, gcs_path: str, overwrite: bool = False, verbose: bool = True,
+                      client: Optional[storage.Client] = None, compression: Optional[str] = None,
+                      serializer: str = "pickle") -> None:
     """Upload a Python object to Google Cloud Storage (using pickle to serialize the object).
 
+    The object is serialized straight into the upload stream, so no serialized copy is held in memory.
+
     :param python_object: The Python object to upload (e.g. a Pandas DataFrame)
     :param gcs_path: The Google Cloud Storage path. Must start with 'gs://'
     :param overwrite: Set this to 'True' if you want to overwrite existing objects on GCS
     :param verbose: Set this to 'False' if you don't want this function to report success. Default is 'True'
+    :param client: The storage client to use. By default a client cached for the process.
+    :param compression: None, "zstd" or "lz4" (which require the zstandard / lz4 libraries). For Parquet, the
+                        codec of the Parquet file.
+    :param serializer: "pickle", or "parquet" to store a DataFrame as Parquet (requires pyarrow). Only
+                       DataFrames that round-trip losslessly are accepted: string column labels, and object
+                       columns holding strings only. Other DataFrames raise a ValueError before anything is
+                       uploaded. Older versions of this library can only read pickled objects.
     """
-    bucket_name, object_name = _parse_gcs_path(gcs_path)
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(object_name)
-    if blob.exists() and not overwrite:
+    blob = _get_blob(gcs_path, client)
+    schema = None
+    if serializer == "parquet":
+        if not isinstance(python_object, pd.DataFrame):
+            raise TypeError(f"Only DataFrames can be serialized to Parquet, not {type(python_object)}.")
+        schema = _parquet_schema(python_object)
+    elif serializer != "pickle":
+        raise ValueError(f"Unknown serializer '{serializer}', use 'pickle' or 'parquet'.")
+
+    try:
+        with blob.open("wb", ignore_flush=True, if_generation_match=None if overwrite else 0) as f:
+            if schema is not None:
+                _write_parquet(python_object, schema, f, compression)
+            else:
+                with _compressed_writer(f, compression) as writer:
+                    pickle.dump(python_object, writer, pickle.HIGHEST_PROTOCOL)
+    except exceptions.PreconditionFailed:
         raise FileExistsError(
-            f"File gs://{bucket_name}/{object_name} already exists. Specify 'overwrite=True' if you want to overwrite.")
-    pickle_bytes = pickle.dumps(python_object, pickle.HIGHEST_PROTOCOL)
-    stream = io.BytesIO(pickle_bytes)
-    blob.upload_from_file(stream)
-    stream.close()
+            f"File {gcs_path} already exists. Specify 'overwrite=True' if you want to overwrite.") from None
     if verbose:
-        print(
-            f"Successfully uploaded object to gs://{bucket_name}/{object_name}")
+        print(f"Successfully uploaded object to {gcs_path}")
     return
 
 
-def gcs_download_object(gcs_path: str, verbose: bool = True) -> Any:
+def gcs_download_object(gcs_path: str, verbose: bool = True, client: Optional[storage.Client] = None,
+                        cache: Optional["GCSCache"] = None) -> Any:
     """Download a serialized Python object from Google Cloud Storage (using pickle to deserialize the object).
 
+    The object is deserialized straight from the download stream, whichever serializer and compression
+    `gcs_upload_object` used.
+
     :param gcs_path: The Google Cloud Storage path. Must start with 'gs://'
     :param verbose: Set this to 'False' if you don't want this function to report success. Default is 'True'
+    :param client: The storage client to use. By default a client cached for the process.
+    :param cache: A `GCSCache` to serve the object from if it is unchanged since it was last downloaded.
 
     :return: A Python object
     """
-    bucket_name, object_name = _parse_gcs_path(gcs_path)
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(object_name)
-    if not blob.exists():
-        raise FileNotFoundError(
-            f"The file gs://{bucket_name}/{object_name} doesn't exist")
-    downstream = io.BytesIO()
-    blob.download_to_file(downstream)
-    downstream.seek(0)
-    down = downstream.read()
+    if cache is not None:
+        with cache.open(gcs_path, client) as f:
+            python_object = _read_object(f)
+    else:
+        blob = _get_blob(gcs_path, client)
+        try:
+            with blob.open("rb") as f:
+                python_object = _read_object(f)
+        except exceptions.NotFound:
+            raise FileNotFoundError(f"The file {gcs_path} doesn't exist") from None
     if verbose:
-        print(
-            f"Successfully downloaded object from gs://{bucket_name}/{object_name}")
-    return pickle.loads(down)
+        print(f"Successfully downloaded object from {gcs_path}")
+    return python_object
 
 
-def gcs_upload_file(file_name: str, gcs_path: str, overwrite: bool = False, verbose: bool=True) -> None:
+def _read_object(f: io.IOBase) -> Any:
+    """Deserialize an object written by `gcs_upload_object` from a seekable file, detecting the format from its
+    leading bytes."""
+    magic = f.read(4)
+    f.seek(0)
+    if magic == PARQUET_MAGIC:
+        return _parquet().read_table(f).to_pandas(split_blocks=True, self_destruct=True)
+    if magic == ZSTD_MAGIC:
+        return pickle.load(_zstandard().ZstdDecompressor().stream_reader(f))
+    if magic == LZ4_MAGIC:
+        with _lz4_frame().LZ4FrameFile(f, mode="rb") as reader:
+            return pickle.load(reader)
+    return pickle.load(f)
+
+
+def _compressed_writer(f: io.IOBase, compression: Optional[str]) -> io.IOBase:
+    """Context manager writing compressed data to `f` without closing it."""
+    if compression is None:
+        return contextlib.nullcontext(f)
+    if compression == "zstd":
+        return _zstandard().ZstdCompressor().stream_writer(f, closefd=False)
+    if compression == "lz4":
+        return _lz4_frame().LZ4FrameFile(f, mode="wb")
+    raise ValueError(f"Unknown compression '{compression}', use None, 'zstd' or 'lz4'.")
+
+
+def _parquet_schema(df: pd.DataFrame) -> "pyarrow.Schema":
+    """Arrow schema to write every chunk of a DataFrame with, so that no chunk is converted to other types
+    than the first one. Raises a ValueError unless the DataFrame round-trips losslessly through Parquet:
+    Parquet stores column labels as strings, and Arrow infers the type of object columns from their values
+    (turning e.g. dicts into structs), so only string labels and object columns of strings are accepted."""
+    _parquet()
+    import pyarrow as pa
+    if (isinstance(df.columns, pd.MultiIndex) or not df.columns.is_unique
+            or not all(isinstance(column, str) for column in df.columns)):
+        raise ValueError("Only DataFrames with unique string column labels can be stored as Parquet, "
+                         "use serializer='pickle'.")
+    preserve_index = not (isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1
+                          and df.index.name is None)
+    index_levels = [df.index.get_level_values(i) for i in range(df.index.nlevels)] if preserve_index else []
+    for name, values in list(df.items()) + [(level.name, level) for level in index_levels]:
+        if values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) not in ("string", "empty"):
+            raise ValueError(f"Column '{name}' holds other objects than strings and cannot be stored as Parquet "
+                             f"losslessly, use serializer='pickle'.")
+
+    try:
+        schema = pa.Schema.from_pandas(df.iloc[:PARQUET_CHUNK_ROWS], preserve_index=preserve_index)
+    except pa.ArrowException as error:
+        raise ValueError(f"The DataFrame cannot be converted to Arrow: {error}") from error
+    # object columns are all strings, even if a chunk holds only missing values
+    index_columns = schema.pandas_metadata["index_columns"]
+    object_fields = [name for name, values in df.items() if values.dtype == object]
+    object_fields += [field for field, level in zip(index_columns, index_levels) if level.dtype == object]
+    for name in object_fields:
+        i = schema.get_field_index(name)
+        schema = schema.set(i, pa.field(name, pa.string()))
+    return schema
+
+
+def _write_parquet(df: pd.DataFrame, schema: "pyarrow.Schema", f: io.IOBase, compression: Optional[str]):
+    """Write a DataFrame to Parquet, converting it to Arrow `PARQUET_CHUNK_ROWS` rows at a time."""
+    import pyarrow as pa
+    preserve_index = schema.pandas_metadata["index_columns"] != []
+    with _parquet().ParquetWriter(f, schema, compression=compression or "snappy") as writer:
+        for start in range(0, max(len(df), 1), PARQUET_CHUNK_ROWS):
+            table = pa.Table.from_pandas(df.iloc[start:start + PARQUET_CHUNK_ROWS], schema=schema,
+                                         preserve_index=preserve_index)
+            writer.write_table(table)
+
+
+def _parquet():
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Storing DataFrames as Parquet requires the pyarrow library, "
+                          "which can be installed with 'pip install pyarrow'.")
+    return pyarrow.parquet
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression requires the zstandard library, "
+                          "which can be installed with 'pip install zstandard'.")
+    return zstandard
+
+
+def _lz4_frame():
+    try:
+        import lz4.frame
+    except ImportError:
+        raise ImportError("lz4 compression requires the lz4 library, which can be installed with 'pip install lz4'.")
+    return lz4.frame
+
+
+def gcs_upload_file(file_name: str, gcs_path: str, overwrite: bool = False, verbose: bool = True,
+                    client: Optional[storage.Client] = None, chunk_size: Optional[int] = None,
+                    max_workers: int = 8, retries: int = 3) -> None:
     """Upload a local file to Google Cloud Storage.
 
+    With `chunk_size`, a file larger than that is uploaded in slices of `chunk_size` bytes over `max_workers`
+    concurrent connections (holding up to `max_workers` slices in memory). The slices are composed into the
+    object and deleted, and the CRC32C checksum of the object is checked against the local file.
+
     :param file_name: The local file name of the file to be uploaded
     :param gcs_path: The Google Cloud Storage path. Must start with 'gs://'
     :param overwrite: Set this to 'True' if you want to overwrite existing objects on GCS
     :param verbose: Set this to 'False' if you don't want this function to report success. Default is 'True'
+    :param client: The storage client to use. By default a client cached for the process.
+    :param chunk_size: The size of the slices in bytes, None to upload over a single connection.
+    :param max_workers: The number of concurrent slice uploads
+    :param retries: How many times a slice upload is retried on transient errors
     """
-    bucket_name, object_name = _parse_gcs_path(gcs_path)
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(object_name)
-    if blob.exists() and not overwrite:
-        raise FileExistsError(
-            f"File gs://{bucket_name}/{object_name} already exists. Specify 'overwrite=True' if you want to overwrite.")
-    f = open(file_name, mode="rb")
-    blob.upload_from_file(f,)
+    blob = _get_blob(gcs_path, client)
+    if chunk_size is not None and os.path.getsize(file_name) > chunk_size:
+        _upload_file_sliced(file_name, blob, overwrite, chunk_size, max_workers, retries)
+    else:
+        _upload_file(file_name, blob, overwrite)
     if verbose:
-        print(f"Successfully uploaded file to gs://{bucket_name}/{object_name}")
+        print(f"Successfully uploaded file to {gcs_path}")
     return
 
 
-def gcs_download_file(gcs_path: str, file_name: str, verbose: bool=True) -> None:
+def gcs_download_file(gcs_path: str, file_name: str, verbose: bool = True,
+                      client: Optional[storage.Client] = None, cache: Optional["GCSCache"] = None,
+                      chunk_size: Optional[int] = None, max_workers: int = 8, retries: int = 3) -> None:
     """Download a file from Google Cloud Storage.
 
+    With `chunk_size`, an object larger than that is downloaded with `max_workers` concurrent ranged reads of
+    `chunk_size` bytes into a preallocated file, and the CRC32C checksum of the file is checked against the
+    object.
+
     :param gcs_path: The Google Cloud Storage path. Must start with 'gs://'
     :param file_name: The local file name where the downloaded file will be stored
     :param verbose: Set this to 'False' if you don't want this function to report success. Default is 'True'
+    :param client: The storage client to use. By default a client cached for the process.
+    :param cache: A `GCSCache` to copy the file from if it is unchanged since it was last downloaded.
+    :param chunk_size: The size of the ranges in bytes, None to download over a single connection.
+    :param max_workers: The number of concurrent ranged reads
+    :param retries: How many times a ranged read is retried on transient errors
     """
-    bucket_name, object_name = _parse_gcs_path(gcs_path)
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(object_name)
-    if not blob.exists():
-        raise FileNotFoundError(
-            f"The file gs://{bucket_name}/{object_name} doesn't exist")
-    f = open(file_name, mode="wb")
-    blob.download_to_file(f)
+    if cache is not None:
+        with cache.open(gcs_path, client) as source, open(file_name, mode="wb") as f:
+            shutil.copyfileobj(source, f)
+    elif chunk_size is not None:
+        _download_file_sliced(_get_blob(gcs_path, client), file_name, chunk_size, max_workers, retries)
+    else:
+        _download_file(_get_blob(gcs_path, client), file_name)
     if verbose:
-        print(
-            f"Successfully downloaded file from gs://{bucket_name}/{object_name}")
+        print(f"Successfully downloaded file from {gcs_path}")
     return
+
+
+def _upload_file_sliced(file_name: str, blob: storage.Blob, overwrite: bool, chunk_size: int, max_workers: int,
+                        retries: int) -> None:
+    """Upload slices of a file as temporary objects and compose them into `blob`, see `gcs_upload_file`."""
+    size = os.path.getsize(file_name)
+    prefix = f"{blob.name}.{uuid.uuid4().hex}.part"
+    temporary_blobs = []
+
+    def upload_slice(start: int, part: storage.Blob) -> None:
+        with open(file_name, mode="rb") as f:
+            f.seek(start)
+            data = f.read(chunk_size)
+        part.upload_from_string(data, if_generation_match=0)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            parts = [blob.bucket.blob(f"{prefix}{i}") for i in range(-(-size // chunk_size))]
+            temporary_blobs.extend(parts)
+            futures = [pool.submit(_with_retries, upload_slice, retries, i * chunk_size, part)
+                       for i, part in enumerate(parts)]
+            checksum = _file_crc32c(file_name)
+            for future in futures:
+                future.result()
+            # GCS composes at most COMPOSE_MAX_SOURCES objects at once: compose the parts in a tree
+            level = 0
+            while len(parts) > COMPOSE_MAX_SOURCES:
+                groups = [parts[i:i + COMPOSE_MAX_SOURCES] for i in range(0, len(parts), COMPOSE_MAX_SOURCES)]
+                parts = [blob.bucket.blob(f"{prefix}{level}.{i}") for i in range(len(groups))]
+                temporary_blobs.extend(parts)
+                for future in [pool.submit(part.compose, group) for part, group in zip(parts, groups)]:
+                    future.result()
+                level += 1
+        try:
+            blob.compose(parts, if_generation_match=None if overwrite else 0)
+        except exceptions.PreconditionFailed:
+            raise FileExistsError(
+                f"File gs://{blob.bucket.name}/{blob.name} already exists. "
+                f"Specify 'overwrite=True' if you want to overwrite.") from None
+    finally:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(_delete_if_exists, temporary_blobs))
+
+    blob.reload()
+    if blob.crc32c != checksum:
+        blob.delete()
+        raise IOError(f"The checksum of gs://{blob.bucket.name}/{blob.name} does not match {file_name}, "
+                      f"the object was deleted.")
+
+
+def _download_file_sliced(blob: storage.Blob, file_name: str, chunk_size: int, max_workers: int,
+                          retries: int) -> None:
+    """Download ranges of `blob` concurrently into a preallocated file, see `gcs_download_file`."""
+    try:
+        blob.reload()
+    except exceptions.NotFound:
+        raise FileNotFoundError(f"The file gs://{blob.bucket.name}/{blob.name} doesn't exist") from None
+    if blob.size <= chunk_size:
+        _download_file(blob, file_name)
+        return
+
+    def download_range(start: int) -> None:
+        # all ranges are read from the same generation of the object
+        data = blob.download_as_bytes(start=start, end=min(start + chunk_size, blob.size) - 1,
+                                      if_generation_match=blob.generation, checksum=None)
+        with open(file_name, mode="r+b") as f:
+            f.seek(start)
+            f.write(data)
+
+    with open(file_name, mode="wb") as f:
+        f.truncate(blob.size)
+    try:
+        _run_many(download_range, [(start,) for start in range(0, blob.size, chunk_size)], max_workers, retries,
+                  "ranged reads")
+        if _file_crc32c(file_name) != blob.crc32c:
+            raise IOError(f"The checksum of {file_name} does not match gs://{blob.bucket.name}/{blob.name}.")
+    except BaseException:
+        os.remove(file_name)
+        raise
+
+
+def _delete_if_exists(blob: storage.Blob) -> None:
+    try:
+        blob.delete()
+    except exceptions.NotFound:
+        pass
+
+
+def _file_crc32c(file_name: str) -> str:
+    """CRC32C checksum of a local file, base64-encoded like `Blob.crc32c`."""
+    import google_crc32c
+    checksum = google_crc32c.Checksum()
+    with open(file_name, mode="rb") as f:
+        for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b""):
+            checksum.update(block)
+    return base64.b64encode(checksum.digest()).decode("ascii")
+
+
+def gcs_upload_many(files: Iterable[Tuple[str, str]], overwrite: bool = False, max_workers: int = 8,
+                    retries: int = 3, verbose: bool = True, client: Optional[storage.Client] = None) -> None:
+    """Upload many local files to Google Cloud Storage concurrently.
+
+    All transfers share one client and bucket handle. Existing objects are detected with a generation
+    precondition on the upload itself rather than a separate request. Transient errors are retried with
+    exponential backoff; the other uploads carry on if one fails, and an error is raised at the end.
+
+    :param files: Pairs of (local file name, Google Cloud Storage path)
+    :param overwrite: Set this to 'True' if you want to overwrite existing objects on GCS
+    :param max_workers: The number of concurrent uploads
+    :param retries: How many times a transfer is retried on transient errors
+    :param verbose: Set this to 'False' if you don't want this function to report success. Default is 'True'
+    :param client: The storage client to use. By default a client cached for the process.
+    """
+    tasks = [(file_name, _get_blob(gcs_path, client), overwrite) for file_name, gcs_path in files]
+    _run_many(_upload_file, tasks, max_workers, retries, "uploads")
+    if verbose:
+        print(f"Successfully uploaded {len(tasks)} files")
+    return
+
+
+def gcs_download_many(files: Iterable[Tuple[str, str]], max_workers: int = 8, retries: int = 3,
+                      verbose: bool = True, client: Optional[storage.Client] = None) -> None:
+    """Download many files from Google Cloud Storage concurrently, see `gcs_upload_many`.
+
+    :param files: Pairs of (Google Cloud Storage path, local file name)
+    :param max_workers: The number of concurrent downloads
+    :param retries: How many times a transfer is retried on transient errors
+    :param verbose: Set this to 'False' if you don't want this function to report success. Default is 'True'
+    :param client: The storage client to use. By default a client cached for the process.
+    """
+    tasks = [(_get_blob(gcs_path, client), file_name) for gcs_path, file_name in files]
+    _run_many(_download_file, tasks, max_workers, retries, "downloads")
+    if verbose:
+        print(f"Successfully downloaded {len(tasks)} files")
+    return
+
+
+class GCSCache:
+    """Local on-disk cache of objects downloaded from Google Cloud Storage.
+
+    Entries are keyed by bucket, object name and generation, so an overwritten object is downloaded again while
+    an unchanged one costs a single metadata request. The least recently used entries are evicted once the
+    cache grows beyond `max_size`. Several processes can share a cache directory: entries are written to a
+    temporary file and renamed, and file locks make concurrent processes wait for a download in progress
+    instead of repeating it.
+
+    :param directory: The directory to store the cached objects in. Created if it does not exist.
+    :param max_size: The maximum total size of the cached objects in bytes, None for no limit.
+    """
+    def __init__(self, directory: str, max_size: Optional[int] = None):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def fetch(self, gcs_path: str, client: Optional[storage.Client] = None) -> str:
+        """Download an object unless it is cached already.
+
+        :param gcs_path: The Google Cloud Storage path. Must start with 'gs://'
+        :param client: The storage client to use. By default a client cached for the process.
+
+        :return: The local path of the cached object, e.g. to memory-map it. Another process may evict it,
+                 use `open` to read it safely.
+        """
+        with self.open(gcs_path, client) as f:
+            return f.name
+
+    def open(self, gcs_path: str, client: Optional[storage.Client] = None) -> io.BufferedReader:
+        """Download an object unless it is cached already and open the cached file for reading.
+        The open file stays readable if the entry is evicted meanwhile.
+
+        :param gcs_path: The Google Cloud Storage path. Must start with 'gs://'
+        :param client: The storage client to use. By default a client cached for the process.
+        """
+        blob = _get_blob(gcs_path, client)
+        try:
+            blob.reload()
+        except exceptions.NotFound:
+            raise FileNotFoundError(f"The file {gcs_path} doesn't exist") from None
+        key = hashlib.sha256(f"{blob.bucket.name}/{blob.name}#{blob.generation}".encode()).hexdigest()
+        path = os.path.join(self.directory, key)
+
+        f = self._open_entry(path)
+        if f is not None:
+            return f
+        with self._lock(path + ".lock"):
+            # another process may have downloaded it while we waited for the lock
+            f = self._open_entry(path)
+            if f is not None:
+                return f
+            self._download(blob, path, gcs_path)
+            # opened before evicting, so that it stays readable even if it is larger than max_size
+            f = self._open_entry(path)
+        self.evict()
+        return f
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache is no larger than `max_size`."""
+        if self.max_size is None:
+            return
+        with self._lock(os.path.join(self.directory, ".lock")):
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and len(entry.name) == 64:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            size = sum(entry[1] for entry in entries)
+            for _, entry_size, path in sorted(entries):
+                if size <= self.max_size:
+                    break
+                os.remove(path)
+                if os.path.exists(path + ".lock"):
+                    os.remove(path + ".lock")
+                size -= entry_size
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock(os.path.join(self.directory, ".lock")):
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name != ".lock":
+                    os.remove(entry.path)
+
+    def _open_entry(self, path: str) -> Optional[io.BufferedReader]:
+        """Open a cached entry and mark it as recently used, None if it is not cached."""
+        with self._lock(os.path.join(self.directory, ".lock")):
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                return None
+            os.utime(path)
+            return f
+
+    def _download(self, blob: storage.Blob, path: str, gcs_path: str) -> None:
+        """Download the generation of the blob checked in `open` to a temporary file renamed to `path`."""
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                blob.download_to_file(f, if_generation_match=blob.generation)
+            os.replace(temp_path, path)
+        except exceptions.PreconditionFailed:
+            os.remove(temp_path)
+            raise RuntimeError(f"The file {gcs_path} changed while it was downloaded, please retry.") from None
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _lock(path: str):
+        with open(path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
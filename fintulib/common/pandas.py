@@ -1,21 +1,186 @@
 """ Pandas-specific helper functions
 """
+import os
+import tracemalloc
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 import pandas as pd
-import numpy as np
 from tqdm import tqdm
 
+# rows of the first chunk that is measured to size chunks with rows_per_chunk="auto"
+AUTO_PROBE_ROWS = 10000
 
-def apply_on_rows_chunkwise(df, func, rows_per_chunk=300000, **kwargs):
+
+def apply_on_rows_chunkwise(df, func, /, rows_per_chunk=300000, chunk_executor=None, chunk_n_jobs=None,
+                            chunk_max_in_flight=None, chunk_memory_fraction=0.5, **kwargs):
     """ Apply a function over rows of a DataFrame in chunks.
     Useful to reduce memory requirements, especially if those grow non-linearly with row number.
+    Chunks are positional slices (views) of the DataFrame, the results are concatenated in chunk order.
     :df: The DataFrame to rowise apply a chunked function over
     :func: The callable function to apply on each chunk
     :rows_per_chunk: Rows per chunk. Optimize manually, for example by setting \
-        such that the operation uses most of the available RAM, but does not swap.
-    :kwargs: Named arguments passed as such to the function func
+        such that the operation uses most of the available RAM, but does not swap. \
+        With "auto", `func` is applied to a first chunk of `AUTO_PROBE_ROWS` rows while measuring \
+        its peak memory, and the remaining chunks are sized to use `chunk_memory_fraction` of the \
+        available RAM across all chunks in flight.
+    :chunk_executor: None to apply `func` sequentially, "threads" or "processes" to apply it on a pool of \
+        `chunk_n_jobs` workers, or a `concurrent.futures.Executor` to submit the chunks to. \
+        With processes, `func`, its arguments and the chunks must be picklable.
+    :chunk_n_jobs: Number of workers of the "threads" / "processes" pool. Defaults to the number of CPUs.
+    :chunk_max_in_flight: Maximum number of chunks submitted but not yet collected, which caps memory. \
+        Defaults to twice the number of workers.
+    :chunk_memory_fraction: Fraction of the available RAM to use with rows_per_chunk="auto".
+    :kwargs: Named arguments passed as such to the function func. The arguments before `rows_per_chunk` \
+        are positional-only and the other options start with chunk_, so any name can be passed on.
     """
+    chunk_n_jobs = chunk_n_jobs or os.cpu_count()
+    chunk_max_in_flight = chunk_max_in_flight or 2 * chunk_n_jobs
+
     df_results_list = []
-    # TODO is there an easy way to parallelize this?
-    for _, df_chunk in tqdm(df.groupby(np.arange(len(df)) // rows_per_chunk)):
-        df_results_list.append(func(df_chunk, **kwargs))
+    start = 0
+    if rows_per_chunk == "auto":
+        df_probe = df.iloc[:AUTO_PROBE_ROWS]
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        df_results_list.append(func(df_probe, **kwargs))
+        _, peak = tracemalloc.get_traced_memory()
+        if not was_tracing:
+            tracemalloc.stop()
+        start = len(df_probe)
+        bytes_per_row = (peak + df_probe.memory_usage(deep=True).sum()) / max(len(df_probe), 1)
+        chunks_in_memory = 1 if chunk_executor is None else chunk_max_in_flight
+        rows_per_chunk = _available_memory() * chunk_memory_fraction / (bytes_per_row * chunks_in_memory)
+    rows_per_chunk = max(int(rows_per_chunk), 1)
+
+    chunk_starts = range(start, len(df), rows_per_chunk)
+    chunks = (df.iloc[chunk_start:chunk_start + rows_per_chunk] for chunk_start in chunk_starts)
+    if chunk_executor is None:
+        for df_chunk in tqdm(chunks, total=len(chunk_starts)):
+            df_results_list.append(func(df_chunk, **kwargs))
+        return pd.concat(df_results_list)
+
+    if chunk_executor == "threads":
+        pool = ThreadPoolExecutor(max_workers=chunk_n_jobs)
+    elif chunk_executor == "processes":
+        pool = ProcessPoolExecutor(max_workers=chunk_n_jobs)
+    elif isinstance(chunk_executor, Executor):
+        pool = chunk_executor
+    else:
+        raise ValueError(f"Unknown chunk_executor '{chunk_executor}', use 'threads', 'processes' or an Executor.")
+    try:
+        # collecting the oldest chunk first keeps the order deterministic
+        in_flight = deque()
+        with tqdm(total=len(chunk_starts)) as progress:
+            for df_chunk in chunks:
+                if len(in_flight) >= chunk_max_in_flight:
+                    df_results_list.append(in_flight.popleft().result())
+                    progress.update()
+                in_flight.append(pool.submit(func, df_chunk, **kwargs))
+            while in_flight:
+                df_results_list.append(in_flight.popleft().result())
+                progress.update()
+    finally:
+        if pool is not chunk_executor:
+            pool.shutdown()
     return pd.concat(df_results_list)
+
+
+def _available_memory():
+    """Available RAM in bytes."""
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def iter_apply_on_file_chunkwise(input_path, func, /, rows_per_chunk=300000, chunk_input_format=None,
+                                 chunk_read_kwargs=None, **kwargs):
+    """ Apply a function over rows of a CSV or Parquet file in chunks, yielding the result of each chunk.
+    Only one chunk of the file is read into memory at a time.
+    :input_path: The CSV or Parquet file to read
+    :func: The callable function to apply on each chunk
+    :rows_per_chunk: Rows per chunk
+    :chunk_input_format: "csv" or "parquet". By default derived from the file extension (.parquet / .pq are Parquet).
+    :chunk_read_kwargs: Named arguments passed to `pd.read_csv` or `pyarrow.parquet.ParquetFile.iter_batches`
+    :kwargs: Named arguments passed as such to the function func. The arguments before `rows_per_chunk` \
+        are positional-only and the other options start with chunk_, so any name can be passed on.
+    """
+    read_kwargs = chunk_read_kwargs or {}
+    input_format = chunk_input_format or _file_format(input_path)
+    if input_format == "csv":
+        total = None
+        df_chunks = pd.read_csv(input_path, chunksize=rows_per_chunk, **read_kwargs)
+    elif input_format == "parquet":
+        parquet_file = _parquet().ParquetFile(input_path)
+        total = -(-parquet_file.metadata.num_rows // rows_per_chunk)
+        df_chunks = (batch.to_pandas()
+                     for batch in parquet_file.iter_batches(batch_size=rows_per_chunk, **read_kwargs))
+    else:
+        raise ValueError(f"Unknown input format '{input_format}', use 'csv' or 'parquet'.")
+    for df_chunk in tqdm(df_chunks, total=total):
+        yield func(df_chunk, **kwargs)
+
+
+def apply_on_file_chunkwise(input_path, output_path, func, /, rows_per_chunk=300000, chunk_input_format=None,
+                            chunk_output_format=None, chunk_read_kwargs=None, chunk_write_kwargs=None, **kwargs):
+    """ Apply a function over rows of a CSV or Parquet file in chunks and write the results to a CSV or
+    Parquet file, chunk by chunk. Neither the input nor the output is held in memory in full.
+    The results of `func` must have the same columns (and, for Parquet, the same types) for all chunks.
+    :input_path: The CSV or Parquet file to read
+    :output_path: The CSV or Parquet file to write. An existing file is overwritten.
+    :func: The callable function to apply on each chunk
+    :rows_per_chunk: Rows per chunk, see `iter_apply_on_file_chunkwise`
+    :chunk_input_format: "csv" or "parquet", by default derived from the file extension
+    :chunk_output_format: "csv" or "parquet", by default derived from the file extension
+    :chunk_read_kwargs: Named arguments passed to the reader, see `iter_apply_on_file_chunkwise`
+    :chunk_write_kwargs: Named arguments passed to `DataFrame.to_csv` or `pyarrow.parquet.ParquetWriter`. \
+        CSV files are written without the index unless `index=True` is passed.
+    :kwargs: Named arguments passed as such to the function func. The arguments before `rows_per_chunk` \
+        are positional-only and the other options start with chunk_, so any name can be passed on.
+    """
+    write_kwargs = chunk_write_kwargs or {}
+    output_format = chunk_output_format or _file_format(output_path)
+    if output_format not in ("csv", "parquet"):
+        raise ValueError(f"Unknown output format '{output_format}', use 'csv' or 'parquet'.")
+    df_results = iter_apply_on_file_chunkwise(input_path, func, rows_per_chunk=rows_per_chunk,
+                                              chunk_input_format=chunk_input_format,
+                                              chunk_read_kwargs=chunk_read_kwargs, **kwargs)
+
+    if output_format == "csv":
+        write_kwargs = {"index": False, **write_kwargs}
+        header = True
+        with open(output_path, "w", newline="") as f:
+            for df_result in df_results:
+                df_result.to_csv(f, header=header, **write_kwargs)
+                header = False
+        return
+
+    import pyarrow as pa
+    writer = None
+    try:
+        for df_result in df_results:
+            if writer is None:
+                table = pa.Table.from_pandas(df_result, preserve_index=False)
+                writer = _parquet().ParquetWriter(output_path, table.schema, **write_kwargs)
+            else:
+                table = pa.Table.from_pandas(df_result, schema=writer.schema, preserve_index=False)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _file_format(path):
+    return "parquet" if os.path.splitext(str(path))[1].lower() in (".parquet", ".pq") else "csv"
+
+
+def _parquet():
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Reading and writing Parquet files requires the pyarrow library, "
+                          "which can be installed with 'pip install pyarrow'.")
+    return pyarrow.parquet
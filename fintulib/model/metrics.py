@@ -1,48 +1,409 @@
 """Metrics to score models not found in the modelling libraries themselves
 """
+import math
 import pandas as pd
 import numpy as np
-from statsmodels.stats.contingency_tables import SquareTable, mcnemar
 
-def _rmspe_weights(y):
-    w = np.zeros(y.shape, dtype=float)
-    ind = y != 0
-    w[ind] = 1./(y[ind]**2)
-    return w
+# bootstrap replicates are drawn in batches of at most this many weights (replicates x rows)
+BOOTSTRAP_BATCH_ELEMENTS = 10_000_000
+
+
+def _squared_percentage_errors(y, yhat):
+    """((y - yhat) / y)**2 per row, 0 where y is 0 (the weights of `RMSPE`), computed in a single buffer"""
+    y = np.asarray(y, dtype=float)
+    errors = np.subtract(y, np.asarray(yhat), dtype=float)
+    zero = y == 0
+    np.divide(errors, y, out=errors, where=~zero)
+    errors[zero] = 0.
+    return np.square(errors, out=errors)
+
+
+def _absolute_percentage_errors(y, y_hat, zero_division="raise"):
+    """|(y - y_hat) / y| per row, computed in a single buffer.
+
+    :param zero_division: "raise" to raise a ValueError if y contains zeros, "ignore" to drop those rows,
+                          "keep" to keep them with an error of inf (nan where y_hat is 0 too).
+    """
+    y = np.asarray(y, dtype=float)
+    errors = np.subtract(y, np.asarray(y_hat), dtype=float)
+    zero = y == 0
+    if zero_division == "keep":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            np.divide(errors, y, out=errors)
+        return np.abs(errors, out=errors)
+    if zero.any():
+        if zero_division == "raise":
+            raise ValueError(f"y contains {zero.sum()} zeros, the percentage error is undefined for them. "
+                             f"Pass zero_division='ignore' to leave them out.")
+        elif zero_division != "ignore":
+            raise ValueError(f"Unknown zero_division '{zero_division}', use 'raise', 'ignore' or 'keep'.")
+        y, errors = y[~zero], errors[~zero]
+    np.divide(errors, y, out=errors)
+    return np.abs(errors, out=errors)
+
 
 # from  https://www.kaggle.com/dimitrislev/xgboost-in-python-with-rmspe
 def RMSPE(y, yhat):
     """Root mean squared percentage error"""
-    w = _rmspe_weights(y)
-    rmspe = np.sqrt(np.mean(w * (y - yhat)**2))
-    return rmspe
+    return np.sqrt(np.mean(_squared_percentage_errors(y, yhat)))
+
+def MAPE(y, y_hat, zero_division="keep"):
+    """Mean Absolute Percentage Error
+
+    :param zero_division: "keep" (default) to keep rows where y is 0, which makes the result inf or nan,
+                          "raise" to raise a ValueError if y contains zeros, "ignore" to leave those rows out.
+    """
+    return np.mean(_absolute_percentage_errors(y, y_hat, zero_division))
+
+def MeAPE(y, y_hat, zero_division="keep"):
+    """Median Absolute Percentage Error
+
+    :param zero_division: "keep" (default) to keep rows where y is 0 with an error of inf (nan if y_hat
+                          is 0 too), "raise" to raise a ValueError if y contains zeros, "ignore" to leave
+                          those rows out.
+    """
+    return np.median(_absolute_percentage_errors(y, y_hat, zero_division))
+
+
+class QuantileSketch:
+    """Mergeable approximate quantiles of non-negative values with a relative accuracy guarantee.
+
+    Values are counted in logarithmic buckets, so that every quantile is returned within
+    `relative_accuracy` of a value of the right rank (zeros are kept exactly). Memory depends on the
+    range of the values, not on their number.
+
+    :param relative_accuracy: The relative error of the returned quantiles.
+    """
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.zero_count = 0
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
 
-def MAPE(y,y_hat):
-    """Mean Absolute Percentage Error"""
-    return np.mean(abs((y - y_hat)/y))
+    @property
+    def count(self):
+        return self.zero_count + int(self.counts.sum())
 
-def MeAPE(y,y_hat):
-    """Median Absolute Percentage Error"""
-    return np.median(abs((y - y_hat)/y))
+    def update(self, values):
+        """Add an array of non-negative values to the sketch."""
+        values = np.asarray(values, dtype=float).ravel()
+        positive = values > 0
+        self.zero_count += int(values.size - positive.sum())
+        if positive.any():
+            buckets = np.ceil(np.log(values[positive]) / math.log(self.gamma)).astype(np.int64)
+            offset = int(buckets.min())
+            self._add_counts(offset, np.bincount(buckets - offset))
+        return self
 
+    def merge(self, other):
+        """Add the values of another sketch with the same relative accuracy."""
+        if other.gamma != self.gamma:
+            raise ValueError("Only sketches with the same relative_accuracy can be merged.")
+        self.zero_count += other.zero_count
+        if other.counts.size:
+            self._add_counts(other.offset, other.counts)
+        return self
 
-def _mcnemar_p_value_cols(df, col1, col2):
-    """Calculate McNemar's test on two columns of a data frame"""
-    table = SquareTable.from_data(df[[col1, col2]])
-    result = mcnemar(table.table)
-    return result.pvalue
+    def quantile(self, q):
+        """Approximate q-quantile of the values added so far, nan if there are none."""
+        count = self.count
+        if count == 0:
+            return np.nan
+        rank = q * (count - 1)
+        if rank < self.zero_count:
+            return 0.
+        bucket = int(np.searchsorted(np.cumsum(self.counts), rank - self.zero_count, side="right"))
+        return 2 * self.gamma ** (self.offset + bucket) / (self.gamma + 1)
+
+    def _add_counts(self, offset, counts):
+        if not self.counts.size:
+            self.offset, self.counts = offset, counts.astype(np.int64)
+            return
+        start = min(self.offset, offset)
+        stop = max(self.offset + self.counts.size, offset + counts.size)
+        merged = np.zeros(stop - start, dtype=np.int64)
+        merged[self.offset - start:self.offset - start + self.counts.size] += self.counts
+        merged[offset - start:offset - start + counts.size] += counts
+        self.offset, self.counts = start, merged
+
+
+class RMSPEAccumulator:
+    """Streaming `RMSPE`: call `update(y, yhat)` on chunks of data and `result()` at the end.
+    Accumulators of the same metric computed on separate workers can be combined with `merge`.
+    """
+    def __init__(self):
+        self.sum = 0.
+        self.count = 0
+
+    def update(self, y, yhat):
+        self.sum += float(_squared_percentage_errors(y, yhat).sum())
+        self.count += len(y)
+        return self
+
+    def merge(self, other):
+        self.sum += other.sum
+        self.count += other.count
+        return self
+
+    def result(self):
+        return math.sqrt(self.sum / self.count) if self.count else np.nan
+
+
+class MAPEAccumulator:
+    """Streaming `MAPE`, see `RMSPEAccumulator`.
+
+    :param zero_division: "raise" to raise a ValueError if y contains zeros, "ignore" to leave those rows out.
+    """
+    def __init__(self, zero_division="raise"):
+        self.zero_division = zero_division
+        self.sum = 0.
+        self.count = 0
+
+    def update(self, y, y_hat):
+        errors = _absolute_percentage_errors(y, y_hat, self.zero_division)
+        self.sum += float(errors.sum())
+        self.count += errors.size
+        return self
+
+    def merge(self, other):
+        self.sum += other.sum
+        self.count += other.count
+        return self
+
+    def result(self):
+        return self.sum / self.count if self.count else np.nan
+
+
+class MeAPEAccumulator:
+    """Streaming approximate `MeAPE`, see `RMSPEAccumulator`. The median is estimated with a `QuantileSketch`.
+
+    :param relative_accuracy: The relative error of the returned median.
+    :param zero_division: "raise" to raise a ValueError if y contains zeros, "ignore" to leave those rows out.
+    """
+    def __init__(self, relative_accuracy=0.01, zero_division="raise"):
+        self.zero_division = zero_division
+        self.sketch = QuantileSketch(relative_accuracy)
 
+    def update(self, y, y_hat):
+        self.sketch.update(_absolute_percentage_errors(y, y_hat, self.zero_division))
+        return self
 
-def mcnemar_p_value(df, sort_columns=True):
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        return self
+
+    def result(self):
+        return self.sketch.quantile(0.5)
+
+
+def bootstrap_ci(y, y_hat, metric="MAPE", n_boot=1000, confidence=0.95, zero_division="raise",
+                 random_state=None):
+    """Bootstrap confidence interval of a metric.
+
+    Uses the Poisson bootstrap: every replicate weights each row with a Poisson(1) count. Replicates are
+    computed in batches as one weighted reduction (a matrix product for the means, a weighted median over
+    the sorted errors for MeAPE) instead of resampling in a Python loop.
+
+    :param y: The true values.
+    :param y_hat: The predicted values.
+    :param metric: "RMSPE", "MAPE" or "MeAPE".
+    :param n_boot: The number of bootstrap replicates.
+    :param confidence: The confidence level of the percentile interval.
+    :param zero_division: See `MAPE`, ignored for RMSPE.
+    :param random_state: Seed or np.random.Generator for reproducible intervals.
+
+    :return: A tuple (estimate, lower, upper) with the metric on the full data and the interval bounds.
+    """
+    if metric == "RMSPE":
+        errors = _squared_percentage_errors(y, y_hat)
+        estimate = np.sqrt(errors.mean())
+    elif metric in ("MAPE", "MeAPE"):
+        errors = _absolute_percentage_errors(y, y_hat, zero_division)
+        if metric == "MeAPE":
+            errors.sort()
+            estimate = np.median(errors)
+        else:
+            estimate = errors.mean()
+    else:
+        raise ValueError(f"Unknown metric '{metric}', use 'RMSPE', 'MAPE' or 'MeAPE'.")
+
+    rng = np.random.default_rng(random_state)
+    batch_size = max(1, BOOTSTRAP_BATCH_ELEMENTS // max(errors.size, 1))
+    replicates = np.empty(n_boot)
+    for start in range(0, n_boot, batch_size):
+        stop = min(start + batch_size, n_boot)
+        weights = rng.poisson(1., size=(stop - start, errors.size)).astype(float)
+        totals = weights.sum(axis=1)
+        if metric == "MeAPE":
+            # the errors are sorted: the weighted median is where the cumulated weight crosses half the total
+            cumulated = np.cumsum(weights, axis=1, out=weights)
+            medians = (cumulated < (totals / 2)[:, None]).sum(axis=1)
+            replicates[start:stop] = errors[np.minimum(medians, errors.size - 1)]
+        else:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                replicates[start:stop] = weights @ errors / totals
+    if metric == "RMSPE":
+        replicates = np.sqrt(replicates)
+    alpha = (1 - confidence) / 2
+    lower, upper = np.nanquantile(replicates, [alpha, 1 - alpha])
+    return estimate, lower, upper
+
+
+def grouped_metrics(y, y_hat, groups, metrics=("RMSPE", "MAPE", "MeAPE"), zero_division="raise"):
+    """Compute metrics for every segment of the data in one vectorized pass, instead of one Python call
+    per group with `groupby().apply`. Sums are accumulated with `np.bincount` and medians are read off the
+    errors sorted by segment.
+
+    :param y: The true values.
+    :param y_hat: The predicted values.
+    :param groups: The segment of every row: an array-like, or a DataFrame / list of array-likes for
+                   segments made of several keys (e.g. store and week). Rows with a missing key are left out.
+    :param metrics: The metrics to compute, any of "RMSPE", "MAPE" and "MeAPE".
+    :param zero_division: See `MAPE`. Rows where y is 0 count towards RMSPE with a weight of 0 like in `RMSPE`.
+
+    :return: A DataFrame with one row per segment (sorted by key): the key columns, the number of rows "n"
+             and one column per metric.
+    """
+    unknown = set(metrics) - {"RMSPE", "MAPE", "MeAPE"}
+    if unknown:
+        raise ValueError(f"Unknown metrics {sorted(unknown)}, use 'RMSPE', 'MAPE' or 'MeAPE'.")
+    codes, uniques = _group_codes(groups)
+    valid = codes >= 0
+    y = np.asarray(y, dtype=float)[valid]
+    y_hat = np.asarray(y_hat, dtype=float)[valid]
+    codes = codes[valid]
+    n_groups = len(uniques)
+    result = {"n": np.bincount(codes, minlength=n_groups)}
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if "RMSPE" in metrics:
+            sums = np.bincount(codes, weights=_squared_percentage_errors(y, y_hat), minlength=n_groups)
+            result["RMSPE"] = np.sqrt(sums / result["n"])
+        if "MAPE" in metrics or "MeAPE" in metrics:
+            errors = _absolute_percentage_errors(y, y_hat, zero_division)
+            error_codes = codes[y != 0] if errors.size < codes.size else codes
+            counts = np.bincount(error_codes, minlength=n_groups)
+            if "MAPE" in metrics:
+                result["MAPE"] = np.bincount(error_codes, weights=errors, minlength=n_groups) / counts
+            if "MeAPE" in metrics:
+                # sorted by segment, then by error: the median of a segment is in the middle of its run
+                errors = errors[np.lexsort((errors, error_codes))]
+                starts = np.cumsum(counts) - counts
+                lower = np.minimum(starts + (counts - 1) // 2, errors.size - 1)
+                upper = np.minimum(starts + counts // 2, errors.size - 1)
+                medians = (errors[lower] + errors[upper]) / 2 if errors.size else np.zeros(n_groups)
+                result["MeAPE"] = np.where(counts > 0, medians, np.nan)
+
+    columns = ["n"] + [metric for metric in ("RMSPE", "MAPE", "MeAPE") if metric in metrics]
+    df = pd.DataFrame({column: result[column] for column in columns}, index=uniques)
+    return df.reset_index()
+
+
+def _group_codes(groups):
+    """Integer code of the segment of every row (-1 for a missing key) and the sorted segment keys.
+    Every key is factorized on its own and its codes are combined with the segments of the previous keys, which
+    is much faster than hashing tuples of keys. The combined codes are factorized again after every key, so they
+    stay below the number of observed segments and cannot overflow."""
+    if isinstance(groups, pd.DataFrame):
+        arrays, names = [groups[column] for column in groups.columns], list(groups.columns)
+    elif isinstance(groups, (list, tuple)):
+        arrays = list(groups)
+        names = [getattr(array, "name", None) or f"group_{i}" for i, array in enumerate(arrays)]
+    else:
+        arrays, names = [groups], [getattr(groups, "name", None) or "group"]
+
+    codes = np.zeros(len(arrays[0]), dtype=np.int64)
+    valid = np.ones(len(arrays[0]), dtype=bool)
+    levels = []
+    # the level codes of the keys of every segment found so far
+    key_codes = []
+    for array in arrays:
+        level_codes, level = pd.factorize(np.asarray(array), sort=True)
+        valid &= level_codes >= 0
+        radix = max(len(level), 1)
+        # sorted, so the segments stay ordered by their keys
+        codes, segments = pd.factorize(codes * radix + np.maximum(level_codes, 0), sort=True)
+        previous, level_codes = np.divmod(segments, radix)
+        key_codes = [keys[previous] for keys in key_codes] + [level_codes]
+        levels.append(level)
+    segment_codes, segments = pd.factorize(codes[valid], sort=True)
+    codes[valid] = segment_codes
+    codes[~valid] = -1
+
+    uniques = pd.MultiIndex(levels=levels, codes=[keys[segments] for keys in key_codes], names=names)
+    return codes, uniques if len(levels) > 1 else uniques.get_level_values(0)
+
+
+# rows of the correctness flags counted at once in `mcnemar_p_value`: small enough to stay in the CPU cache
+# and for exact float32 / int32 counts
+MCNEMAR_CHUNK_ROWS = 4096
+
+
+def _mcnemar_discordant_counts(flags, pairs, pairwise, chunk_rows=MCNEMAR_CHUNK_ROWS):
+    """Discordant counts (first True / second False, first False / second True) of column pairs of a boolean
+    matrix. Only the column sums and the number of rows where both are True are needed: for the full pairwise
+    matrix both come from the matrix product `flags.T @ flags`, for adjacent pairs from `&` of shifted
+    columns."""
+    n_cols = flags.shape[1]
+    if pairwise:
+        both = np.zeros((n_cols, n_cols), dtype=np.int64)
+        for start in range(0, flags.shape[0], chunk_rows):
+            chunk = flags[start:start + chunk_rows].astype(np.float32)
+            both += np.rint(chunk.T @ chunk).astype(np.int64)
+        sums = np.diag(both)
+        both = both[pairs]
+    else:
+        sums = np.zeros(n_cols, dtype=np.int64)
+        both = np.zeros(n_cols - 1, dtype=np.int64)
+        for start in range(0, flags.shape[0], chunk_rows):
+            chunk = flags[start:start + chunk_rows].view(np.uint8)
+            sums += chunk.sum(axis=0, dtype=np.int32)
+            both += (chunk[:, :-1] & chunk[:, 1:]).sum(axis=0, dtype=np.int32)
+    first, second = pairs
+    return sums[first] - both, sums[second] - both
+
+
+def _mcnemar_p_values(n_10, n_01, exact=True, correction=True):
+    """McNemar's test p-values from arrays of discordant counts, as `statsmodels.stats.contingency_tables.mcnemar`."""
+    from scipy import stats
+    n = n_10 + n_01
+    if exact:
+        return np.minimum(1., 2 * stats.binom.cdf(np.minimum(n_10, n_01), n, 0.5))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        statistic = (np.abs(n_10 - n_01) - (1. if correction else 0.)) ** 2 / n
+    return stats.chi2.sf(statistic, 1)
+
+
+def mcnemar_p_value(df, sort_columns=True, pairwise=False, exact=True, correction=True):
     """Calculate McNemar's test on subsequent columns of a data frame.
-    
+
+    The columns hold correctness flags (booleans or 0/1) of one model each. The discordant counts of all pairs
+    are computed in one pass over the data, and the p-values vectorized.
+
     :param df: The data frame to use.
     :param sort_columns: If true, columns will be sorted by their name before calculating McNemar's test scores.
+    :param pairwise: If true, test all pairs of columns instead of subsequent columns only.
+    :param exact: If true, use the exact binomial distribution, otherwise the chi-square distribution.
+    :param correction: If true, use the continuity correction of the chi-square statistic.
+
+    :return: A DataFrame indexed by the pair of columns ("col1", "col2") with the int64 discordant counts
+             "n_10" (col1 True, col2 False) and "n_01" (col1 False, col2 True) and the float "p_value".
     """
     if sort_columns:
         cols = list(df.columns.sort_values())
     else:
         cols = list(df.columns)
-    pairs = list(zip(cols, cols[1:]))
-    p_values = [_mcnemar_p_value_cols(df, p[0], p[1]) for p in pairs]
-    return pd.DataFrame(np.array([pairs, p_values]).T, columns=["pair", "p_value"]).set_index("pair")
+    if pairwise:
+        pairs = np.triu_indices(len(cols), k=1)
+    else:
+        pairs = (np.arange(len(cols) - 1), np.arange(1, len(cols)))
+    flags = df[cols].to_numpy(dtype=bool)
+    if len(cols) > 1:
+        n_10, n_01 = _mcnemar_discordant_counts(flags, pairs, pairwise)
+    else:
+        n_10 = n_01 = np.zeros(0, dtype=np.int64)
+    cols = np.array(cols, dtype=object)
+    index = pd.MultiIndex.from_arrays([cols[pairs[0]], cols[pairs[1]]], names=["col1", "col2"])
+    return pd.DataFrame({"n_10": n_10, "n_01": n_01, "p_value": _mcnemar_p_values(n_10, n_01, exact, correction)},
+                        index=index)
@@ -1,25 +1,109 @@
 import pandas as pd
 import numpy as np
 import dill as pickle
+import importlib
+import json
+import os
 import re
-from sklearn.feature_extraction.text import TfidfVectorizer
-from scipy.sparse import csr_matrix
+import shutil
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer, TfidfVectorizer
+from sklearn.pipeline import make_pipeline
+from scipy.sparse import csr_matrix, hstack, vstack
 from scipy.sparse import rand
+from scipy.sparse.csgraph import connected_components
+
+
+# rows of the left matrix multiplied at a time by the SciPy backend of cossim_top
+SCIPY_BLOCK_ROWS = 4096
+# _top_n_per_row prefilters the values with TOP_N_LEVELS buckets per row if there are more than
+# TOP_N_PREFILTER_FACTOR * ntop values per row on average
+TOP_N_LEVELS = 256
+TOP_N_PREFILTER_FACTOR = 4
+
+
+def cossim_top(A, B, ntop, lower_bound=0, n_jobs=1, chunk_size=None, pool="processes", backend="auto"):
+    """Calculate the top `ntop` entries per row of `A * B` that are greater than `lower_bound`.
+
+    The rows of `A` can be split into blocks of `chunk_size` rows that are processed on a pool of
+    `n_jobs` workers. `B` is shared read-only between the workers: threads use it directly, worker
+    processes receive it once at start-up (inherited without pickling on platforms that fork).
+    Only one block per worker is held in the kernel's output buffers at any time.
+
+    :param A: CSR matrix of shape (M, V), e.g. the vectorized lookup strings.
+    :param B: Sparse matrix of shape (V, N), e.g. the transposed vectorized corpus.
+    :param ntop: The number of top results to keep per row.
+    :param lower_bound: Only results greater than this value are kept.
+    :param n_jobs: The number of workers, -1 uses all cores.
+    :param chunk_size: Rows of `A` per block. Defaults to splitting `A` evenly across the workers.
+    :param pool: "processes" or "threads". The sparse_dot_topn kernel holds the GIL, so only
+                 processes scale across cores with it.
+    :param backend: "sparse_dot_topn" uses the accelerated library from https://github.com/ing-bank/sparse_dot_topn,
+                    "scipy" multiplies blocks of `SCIPY_BLOCK_ROWS` rows with SciPy and selects the top
+                    entries with NumPy, "auto" (default) uses sparse_dot_topn if it is installed and SciPy otherwise.
+    """
+    backend = _resolve_backend(backend)
+    B = B.tocsr()
+    A = A.tocsr()
+    M, _ = A.shape
+    _, N = B.shape
 
-
-def cossim_top(A, B, ntop, lower_bound=0):
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if chunk_size is None:
+        if n_jobs == 1:
+            return _cossim_top_block(A, B, ntop, lower_bound, backend)
+        chunk_size = -(-M // n_jobs)
+    chunk_size = max(int(chunk_size), 1)
+
+    blocks = (A[start:start+chunk_size] for start in range(0, M, chunk_size))
+    if n_jobs == 1:
+        results = [_cossim_top_block(block, B, ntop, lower_bound, backend) for block in blocks]
+    elif pool == "threads":
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            results = _map_in_flight(executor, _cossim_top_block, blocks, 2 * n_jobs,
+                                     B, ntop, lower_bound, backend)
+    elif pool == "processes":
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_cossim_worker,
+                                 initargs=(B,)) as executor:
+            results = _map_in_flight(executor, _cossim_top_worker, blocks, 2 * n_jobs,
+                                     ntop, lower_bound, backend)
+    else:
+        raise ValueError(f"Unknown pool '{pool}', use 'processes' or 'threads'.")
+
+    if not results:
+        return csr_matrix((M, N), dtype=A.dtype)
+    return vstack(results, format="csr")
+
+
+def _resolve_backend(backend):
+    if backend not in ("auto", "sparse_dot_topn", "scipy"):
+        raise ValueError(f"Unknown backend '{backend}', use 'auto', 'sparse_dot_topn' or 'scipy'.")
+    if backend == "scipy":
+        return backend
     try:
-        import sparse_dot_topn.sparse_dot_topn as ct
-    except ModuleNotFoundError:
-        print("This module requires the sparse_dot_topn library \
-        accelerated sparse matrix multiplication,which can be found \
-        at https://github.com/ing-bank/sparse_dot_topn.")
-        import sys
-        sys.exit(1)
-    B = B.tocsr()
+        importlib.import_module("sparse_dot_topn.sparse_dot_topn")
+    except ImportError:
+        if backend == "auto":
+            return "scipy"
+        raise ImportError("The sparse_dot_topn backend requires the sparse_dot_topn library for \
+accelerated sparse matrix multiplication, which can be found at https://github.com/ing-bank/sparse_dot_topn.")
+    return "sparse_dot_topn"
+
 
+def _cossim_top_block(A, B, ntop, lower_bound, backend="sparse_dot_topn"):
     M, _ = A.shape
     _, N = B.shape
+    if A.nnz == 0 or B.nnz == 0:
+        # nothing to multiply -- the kernel can't handle empty buffers
+        return csr_matrix((M, N), dtype=A.dtype)
+    if backend == "scipy":
+        return _scipy_top_block(A, B, ntop, lower_bound)
+
+    import sparse_dot_topn.sparse_dot_topn as ct
 
     idx_dtype = np.int32
 
@@ -40,33 +124,244 @@ def cossim_top(A, B, ntop, lower_bound=0):
         lower_bound,
         indptr, indices, data)
 
-    return csr_matrix((data, indices, indptr), shape=(M, N))
+    # drop the unused tail of the output buffers
+    nnz = indptr[-1]
+    return csr_matrix((data[:nnz].copy(), indices[:nnz].copy(), indptr), shape=(M, N))
+
+
+# read-only right hand side matrix of cossim_top, set once per worker process
+_worker_B = None
+
+
+def _map_in_flight(executor, func, blocks, max_in_flight, *args):
+    """Like `executor.map(func, blocks, ...)`, but with at most `max_in_flight` blocks submitted and
+    not yet collected, so the blocks aren't all sliced (and pickled for processes) up front."""
+    results = []
+    # collecting the oldest block first keeps the order of the results
+    in_flight = deque()
+    for block in blocks:
+        if len(in_flight) >= max_in_flight:
+            results.append(in_flight.popleft().result())
+        in_flight.append(executor.submit(func, block, *args))
+    while in_flight:
+        results.append(in_flight.popleft().result())
+    return results
+
+
+def _init_cossim_worker(B):
+    global _worker_B
+    _worker_B = B
+
+
+def _cossim_top_worker(A, ntop, lower_bound, backend):
+    return _cossim_top_block(A, _worker_B, ntop, lower_bound, backend)
+
+
+def _scipy_top_block(A, B, ntop, lower_bound):
+    """The SciPy backend of `cossim_top()`. The product is only held for `SCIPY_BLOCK_ROWS` rows at a time,
+    the top entries of each row are selected with `_top_n_per_row()`."""
+    results = []
+    for start in range(0, A.shape[0], SCIPY_BLOCK_ROWS):
+        product = (A[start:start+SCIPY_BLOCK_ROWS] @ B).tocsr()
+        row_counts = np.diff(product.indptr)
+        rows = np.repeat(np.arange(product.shape[0]), row_counts)
+        results.append(_top_n_per_row(rows, product.indices, product.data, product.shape, ntop, lower_bound,
+                                      row_counts))
+    return vstack(results, format="csr")
+
+
+def _top_n_per_row(rows, cols, data, shape, ntop, lower_bound=0, row_counts=None):
+    """Build a CSR matrix from (row, column, value) triplets, keeping only the `ntop` largest
+    values greater than `lower_bound` per row, sorted in descending order like `cossim_top()`.
+    If the triplets are sorted by row, pass the number of values per row as `row_counts`."""
+    if len(data) > TOP_N_PREFILTER_FACTOR * ntop * shape[0]:
+        keep = _top_n_candidates(rows, data, shape[0], ntop, row_counts)
+        keep &= data > lower_bound
+    else:
+        keep = data > lower_bound
+    rows, cols, data = rows[keep], cols[keep], data[keep]
+    order = np.lexsort((-data, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+
+    counts = np.bincount(rows, minlength=shape[0])
+    row_starts = np.cumsum(counts) - counts
+    keep = np.arange(len(rows)) - row_starts[rows] < ntop
+    indptr = np.concatenate([[0], np.cumsum(np.minimum(counts, ntop))])
+    return csr_matrix((data[keep], cols[keep], indptr), shape=shape)
+
+
+def _top_n_candidates(rows, data, n_rows, ntop, row_counts=None):
+    """A superset of the `ntop` largest values per row, found in linear time: values are counted in
+    `TOP_N_LEVELS` buckets per row, and only the buckets needed to reach `ntop` values are kept."""
+    low, high = data.min(), data.max()
+    scale = (TOP_N_LEVELS - 1) / (high - low) if high > low else 0.
+    # bucket 0 holds the largest values
+    buckets = np.subtract(high, data)
+    buckets *= scale
+    buckets = buckets.astype(np.int32)
+    np.minimum(buckets, TOP_N_LEVELS - 1, out=buckets)
+    if row_counts is not None:
+        keys = np.repeat(np.arange(n_rows, dtype=np.int64) * TOP_N_LEVELS, row_counts)
+    else:
+        keys = rows * TOP_N_LEVELS
+    keys += buckets
+    counts = np.bincount(keys, minlength=n_rows * TOP_N_LEVELS).reshape(n_rows, TOP_N_LEVELS).cumsum(axis=1)
+    # the first bucket reaching ntop values, or all buckets for rows with fewer values
+    last_bucket = (counts < ntop).sum(axis=1).astype(np.int32)
+    return buckets <= (np.repeat(last_bucket, row_counts) if row_counts is not None else last_bucket[rows])
+
+
+def _rowwise_dot(A, B):
+    """Dot products of the aligned rows of two sparse matrices of equal shape."""
+    return np.asarray(A.multiply(B).sum(axis=1)).ravel()
+
+
+class CandidateIndex:
+    """An inverted index on the rare n-grams of a corpus, used to find match candidates
+    without multiplying against the full corpus matrix.
+
+    Candidates for a lookup are the corpus entries scoring highest on the n-grams whose IDF is at
+    least the `idf_quantile` quantile of the IDF weights of the n-grams occurring in the corpus.
+    Since rare n-grams only occur in few corpus entries, this is much cheaper than the exact
+    product. The candidates are then rescored exactly. Lookups without any rare n-gram are matched exactly against the full corpus.
+
+    Raising `idf_quantile` or lowering `n_candidates` trades recall for speed.
+    Note that the index holds a second, row-wise copy of the corpus matrix for rescoring.
+    """
+
+    def __init__(self, corpus_vect, idf, idf_quantile=0.5, n_candidates=50):
+        """Build the index.
+
+        :param corpus_vect: The (transposed) corpus matrix, see `FuzzyMatcher.corpus_vect`.
+        :param idf: The IDF weights of the features of `corpus_vect`.
+        :param idf_quantile: N-grams with an IDF weight of at least this quantile are indexed.
+        :param n_candidates: The number of candidates per lookup that are rescored exactly.
+        """
+        self.idf_quantile = idf_quantile
+        self.n_candidates = n_candidates
+        self.corpus_vect = corpus_vect.tocsr()
+        idf = np.asarray(idf)
+        # features absent from the corpus (most of them with n_features) can't find candidates
+        present = np.diff(self.corpus_vect.indptr) > 0
+        self.rare_features = present & (idf >= np.quantile(idf[present] if present.any() else idf, idf_quantile))
+        self.rare_corpus_vect = self.corpus_vect[self.rare_features]
+        self.corpus_rows = self.corpus_vect.transpose().tocsr()
+
+    def match(self, strings_vect, ntop, lower_bound=0, n_jobs=1, chunk_size=None, pool="processes",
+              backend="auto", pairs_per_block=1000000):
+        """Approximate `cossim_top(strings_vect, corpus_vect, ntop, lower_bound)`.
+
+        :param strings_vect: The vectorized lookup strings.
+        :param pairs_per_block: The number of candidate pairs rescored at a time, which bounds memory.
+        See `cossim_top()` for the other parameters.
+        """
+        strings_vect = strings_vect.tocsr()
+        shape = (strings_vect.shape[0], self.corpus_vect.shape[1])
+        rare_vect = strings_vect[:, self.rare_features]
+        candidates = cossim_top(rare_vect, self.rare_corpus_vect, self.n_candidates, 0,
+                                n_jobs=n_jobs, chunk_size=chunk_size, pool=pool, backend=backend)
+        rows = np.repeat(np.arange(shape[0]), np.diff(candidates.indptr))
+        cols = candidates.indices
+        scores = np.concatenate([np.zeros(0)] + [
+            _rowwise_dot(strings_vect[rows[i:i+pairs_per_block]], self.corpus_rows[cols[i:i+pairs_per_block]])
+            for i in range(0, len(rows), pairs_per_block)])
+
+        fallback_rows = np.flatnonzero(np.diff(rare_vect.indptr) == 0)
+        if len(fallback_rows):
+            exact = cossim_top(strings_vect[fallback_rows], self.corpus_vect, ntop, lower_bound,
+                               n_jobs=n_jobs, chunk_size=chunk_size, pool=pool, backend=backend)
+            rows = np.concatenate([rows, fallback_rows[np.repeat(np.arange(len(fallback_rows)),
+                                                                 np.diff(exact.indptr))]])
+            cols = np.concatenate([cols, exact.indices])
+            scores = np.concatenate([scores, exact.data])
+            order = np.argsort(rows, kind="stable")
+            rows, cols, scores = rows[order], cols[order], scores[order]
+
+        # select the top n per block of rows like _scipy_top_block, which bounds the memory of the selection
+        results = [csr_matrix((0, shape[1]))]
+        for start in range(0, shape[0], SCIPY_BLOCK_ROWS):
+            n_rows = min(SCIPY_BLOCK_ROWS, shape[0] - start)
+            lo, hi = np.searchsorted(rows, [start, start + n_rows])
+            block_rows = rows[lo:hi] - start
+            results.append(_top_n_per_row(block_rows, cols[lo:hi], scores[lo:hi], (n_rows, shape[1]), ntop,
+                                          lower_bound, np.bincount(block_rows, minlength=n_rows)))
+        return vstack(results, format="csr")
+
+
+# characters removed from (lowercased) strings before n-grams are extracted
+STRIP_PATTERN = r'[,-./]|\sBD'
+_STRIP_RE = re.compile(STRIP_PATTERN)
+
+# version of the on-disk format written by `FuzzyMatcher.save()`
+FORMAT_VERSION = 2
+
+
+class NGramAnalyzer:
+    """Split a normalized string into its character n-grams.
+    A plain class rather than a closure, so vectorizers using it can be pickled without dill."""
+
+    def __init__(self, n_grams):
+        self.n_grams = n_grams
+
+    def __call__(self, string):
+        n = self.n_grams
+        return [string[i:i+n] for i in range(len(string) - n + 1)]
 
 
 class FuzzyMatcher:
     """A fuzzy string matcher based on TF-IDF weighted cosine similarity of character n-grams.
     This class uses the accelerated sparse matrix multiplication library from \
-    https://github.com/ing-bank/sparse_dot_topn and cython - please install before use."""
+    https://github.com/ing-bank/sparse_dot_topn and cython if installed, and a slower SciPy
+    implementation otherwise (see `cossim_top()`)."""
 
-    def __init__(self, n_grams=3, verbose=True):
+    def __init__(self, n_grams=3, verbose=True, n_jobs=1, chunk_size=None, pool="processes",
+                 n_features=None, backend="auto", exact_index=False, cache_size=0):
         """Create a new fuzzy matcher.
 
         :param n_grams: The number of characters to be used in n-grams. See https://en.wikipedia.org/wiki/N-gram for more details.
         :param verbose: If true, the fuzzy matcher prints information messages during execution.
+        :param n_features: If set, n-grams are hashed into this many features (`HashingVectorizer`)
+                           instead of being kept in a vocabulary. This saves the memory and pickling
+                           cost of the vocabulary, at the risk of hash collisions between n-grams.
+        :param n_jobs: The number of workers used to calculate cosine similarities, -1 uses all cores.
+        :param chunk_size: The number of lookup strings per block of work. Smaller blocks reduce peak memory.
+        :param pool: "processes" or "threads", see `cossim_top()`.
+        :param backend: "auto", "sparse_dot_topn" or "scipy", see `cossim_top()`.
+        :param exact_index: If true, keep an index from normalized (lowercased, stripped) corpus strings to
+                            corpus ids. Lookups whose normalized form occurs at least `top_n` times in the
+                            corpus are answered with these exact matches (score 1.0) directly, without the
+                            sparse engine, unless the threshold is 1 or more. Other lookups are matched as
+                            usual, so results only differ where the engine scores identical strings a
+                            rounding error below 1.0 or orders those ties differently.
+        :param cache_size: If greater than 0, the results of up to this many normalized lookups are kept
+                           in a least-recently-used cache and repeated lookups are answered from it.
         """
         self.verbose = verbose
-        def ngrams_extractor(string):
-            string = re.sub(r'[,-./]|\sBD', r'', string)
-            ngrams = zip(*[string[i:] for i in range(n_grams)])
-            return [''.join(ngram) for ngram in ngrams]
-
-        self.vectorizer = TfidfVectorizer(analyzer=ngrams_extractor, norm="l2")
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.pool = pool
+        self.backend = backend
+        if n_features is None:
+            self.vectorizer = TfidfVectorizer(analyzer=NGramAnalyzer(n_grams), norm="l2")
+        else:
+            self.vectorizer = make_pipeline(
+                HashingVectorizer(analyzer=NGramAnalyzer(n_grams), n_features=n_features,
+                                  alternate_sign=False, norm=None),
+                TfidfTransformer(norm="l2"))
+        self.n_features = n_features
         self.n_grams_n = n_grams
         self.is_fitted = False
         self.corpus = None
         self.corpus_vect = None
+        self.corpus_removed = None
+        self.candidate_index = None
+        self.exact_index = exact_index
+        self.key_index = None
+        self.cache_size = cache_size
+        self.result_cache = OrderedDict()
+        self.cache_stats = {"exact_hits": 0, "cache_hits": 0, "misses": 0}
         self.attributes = ["vectorizer", "n_grams_n",
-                           "is_fitted", "corpus", "corpus_vect"]
+                           "is_fitted", "corpus", "corpus_vect", "corpus_removed", "n_features"]
 
     def save_state(self, filename):
         """Save the current state of this matcher (including vocabulary and corpus)
@@ -87,7 +382,119 @@ class FuzzyMatcher:
         """
         state = pickle.load(open(filename, "rb"))
         for a in self.attributes:
-            setattr(self, a, state[a])
+            # states saved by older versions don't have all attributes
+            setattr(self, a, state.get(a))
+        if self.corpus_vect is not None:
+            # older versions saved the transposed corpus matrix as CSC
+            self.corpus_vect = self.corpus_vect.tocsr()
+        self._corpus_changed()
+
+    def save(self, directory):
+        """Save the current state of this matcher to a directory in a versioned binary format.
+
+        Unlike `save_state()`, the format does not pickle any Python objects: the vocabulary and
+        the corpus strings are stored as offsets + UTF-8 bytes, the IDF weights and the sparse
+        corpus matrix as `.npy` files, so `load()` can memory-map them.
+
+        :param directory: The directory to save to. It is created if it doesn't exist and replaced
+                          if it does, so a matcher loaded from it with `mmap=True` can save back to it.
+        """
+        # write next to the target and swap it in, the target may be memory-mapped by this matcher
+        directory = os.path.abspath(directory)
+        parent, name = os.path.split(directory)
+        os.makedirs(parent, exist_ok=True)
+        tmp_directory = os.path.join(parent, f".{name}.{uuid.uuid4().hex}.tmp")
+        os.mkdir(tmp_directory)
+        try:
+            self._save_to(tmp_directory)
+            if os.path.exists(directory):
+                old_directory = os.path.join(parent, f".{name}.{uuid.uuid4().hex}.old")
+                os.replace(directory, old_directory)
+                os.replace(tmp_directory, directory)
+                shutil.rmtree(old_directory)
+            else:
+                os.replace(tmp_directory, directory)
+        except BaseException:
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+            raise
+
+    def _save_to(self, directory):
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "n_grams_n": self.n_grams_n,
+            "preprocessing": self._preprocessing(),
+            "n_features": self.n_features,
+            "is_fitted": self.is_fitted,
+            "has_corpus": self.corpus_vect is not None,
+        }
+        if self.is_fitted and self.n_features is None:
+            vocabulary = self.vectorizer.vocabulary_
+            terms = [None] * len(vocabulary)
+            for term, i in vocabulary.items():
+                terms[i] = term
+            _save_strings(directory, "vocabulary", terms)
+        if self.is_fitted:
+            np.save(os.path.join(directory, "idf.npy"), self._tfidf().idf_)
+        if self.corpus_vect is not None:
+            corpus_vect = self.corpus_vect.tocsr()
+            meta["corpus_vect_shape"] = list(corpus_vect.shape)
+            for component in ("data", "indices", "indptr"):
+                np.save(os.path.join(directory, f"corpus_vect_{component}.npy"), getattr(corpus_vect, component))
+            _save_strings(directory, "corpus", self.corpus)
+            if self.corpus_removed is not None:
+                np.save(os.path.join(directory, "corpus_removed.npy"), self.corpus_removed)
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    def load(self, directory, mmap=True):
+        """Read the state of this matcher from a directory written by `save()`.
+
+        The n-gram size and the preprocessing settings of this matcher must match the saved ones.
+        With `mmap=True` the corpus matrix and the corpus strings are memory-mapped read-only
+        instead of read into memory, so loading is nearly instant and processes loading the same
+        directory share the pages. `corpus` is then a read-only sequence of strings.
+
+        :param directory: The directory to read from.
+        :param mmap: If true, memory-map the large arrays instead of reading them.
+        """
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["format_version"] > FORMAT_VERSION:
+            raise ValueError(
+                f"Saved matcher has format version {meta['format_version']}, "
+                f"this version of fintulib reads up to version {FORMAT_VERSION}.")
+        if meta["n_grams_n"] != self.n_grams_n:
+            raise ValueError(
+                f"Saved matcher uses n_grams={meta['n_grams_n']}, this matcher uses n_grams={self.n_grams_n}.")
+        if meta["preprocessing"] != self._preprocessing():
+            raise ValueError(
+                f"Saved matcher uses preprocessing {meta['preprocessing']}, "
+                f"this matcher uses {self._preprocessing()}.")
+        if meta.get("n_features") != self.n_features:
+            raise ValueError(
+                f"Saved matcher uses n_features={meta.get('n_features')}, this matcher uses n_features={self.n_features}.")
+
+        mmap_mode = "r" if mmap else None
+        if meta["is_fitted"]:
+            if self.n_features is None:
+                terms = _load_strings(directory, "vocabulary", mmap_mode)
+                self.vectorizer.vocabulary_ = {term: i for i, term in enumerate(terms)}
+            self._tfidf().idf_ = np.load(os.path.join(directory, "idf.npy"))
+        if meta["has_corpus"]:
+            data, indices, indptr = [
+                np.load(os.path.join(directory, f"corpus_vect_{component}.npy"), mmap_mode=mmap_mode)
+                for component in ("data", "indices", "indptr")]
+            self.corpus_vect = csr_matrix((data, indices, indptr), shape=tuple(meta["corpus_vect_shape"]),
+                                          copy=False)
+            self.corpus = _load_strings(directory, "corpus", mmap_mode)
+            removed_file = os.path.join(directory, "corpus_removed.npy")
+            self.corpus_removed = np.load(removed_file) if os.path.exists(removed_file) else None
+        else:
+            self.corpus = None
+            self.corpus_vect = None
+            self.corpus_removed = None
+        self.is_fitted = meta["is_fitted"]
+        self._corpus_changed()
 
     def fit(self, strings):
         """Fit a set of raw strings - this set is used to calculate inverse document frequency (IDF)
@@ -96,8 +503,7 @@ class FuzzyMatcher:
         :param strings: An iterable of raw strings on which the inverse document frequency of n-grams
                         for the matcher is calculated.
         """
-        lc_strings = self._to_lowercase(strings)
-        self.vectorizer.fit(lc_strings)
+        self.vectorizer.fit(self._normalize(strings))
         self.is_fitted = True
 
     def add_corpus(self, corpus):
@@ -106,33 +512,198 @@ class FuzzyMatcher:
 
         :param corpus: An interable of strings that will be used as the corpus for `match_against_corpus()`.
         """
-        lc_corpus = self._to_lowercase(corpus)
+        lc_corpus = self._normalize(corpus)
         if self.is_fitted == False:
             if self.verbose:
                 print("Fitting vectorizer to corpus...")
-            corpus_vect = self.vectorizer.fit_transform(lc_corpus).transpose()
+            corpus_vect = self.vectorizer.fit_transform(lc_corpus).transpose().tocsr()
         else:
-            corpus_vect = self.vectorizer.transform(lc_corpus).transpose()
+            corpus_vect = self.vectorizer.transform(lc_corpus).transpose().tocsr()
         self.corpus = corpus
         self.corpus_vect = corpus_vect
+        self.corpus_removed = None
         self.is_fitted = True
+        self._corpus_changed()
+
+    def extend_corpus(self, strings):
+        """Append strings to the corpus. Only the new strings are vectorized (with the current
+        vocabulary and IDF weights), the existing corpus matrix is extended by their columns.
+        New strings get the ids following the current corpus. If there is no corpus yet, this is
+        the same as `add_corpus()`.
+
+        Note that n-grams which are not in the vocabulary are ignored for the new strings.
+
+        :param strings: An iterable of strings to add to the corpus.
+        """
+        if self.corpus_vect is None:
+            self.add_corpus(strings)
+            return
+        strings = list(strings)
+        delta_vect = self._vectorize(strings).transpose().tocsr()
+        self.corpus_vect = hstack([self.corpus_vect, delta_vect], format="csr")
+        if self.key_index is not None:
+            self._index_keys(strings, np.bincount(delta_vect.indices, minlength=len(strings)) > 0,
+                             first_id=len(self.corpus))
+        self.corpus = list(self.corpus) + strings
+        if self.corpus_removed is not None:
+            self.corpus_removed = np.concatenate([self.corpus_removed, np.zeros(len(strings), dtype=bool)])
+        self._corpus_changed(keep_key_index=True)
+
+    def remove_from_corpus(self, ids):
+        """Remove entries from the corpus so they are no longer matched.
+
+        Removed entries are tombstoned: their entries in the corpus matrix are dropped, but their
+        ids stay reserved so the ids of all other entries remain valid. Use `compact()` to reclaim
+        the space.
+
+        :param ids: The ids (positions) of the corpus entries to remove.
+        """
+        if self.corpus_vect is None:
+            raise Exception("Must add a corpus before removing from it.")
+        if self.corpus_removed is None:
+            self.corpus_removed = np.zeros(self.corpus_vect.shape[1], dtype=bool)
+        ids = np.asarray(ids, dtype=np.int64)
+        self.corpus_removed[ids] = True
+        if self.key_index is not None:
+            for i in ids.tolist():
+                key = self._normalize([self.corpus[i]])[0]
+                if i in self.key_index.get(key, ()):
+                    self.key_index[key].remove(i)
+                    if not self.key_index[key]:
+                        del self.key_index[key]
+
+        corpus_vect = self.corpus_vect
+        keep = ~self.corpus_removed[corpus_vect.indices]
+        kept_before = np.concatenate([[0], np.cumsum(keep)])
+        self.corpus_vect = csr_matrix(
+            (corpus_vect.data[keep], corpus_vect.indices[keep], kept_before[corpus_vect.indptr]),
+            shape=corpus_vect.shape)
+        self._corpus_changed(keep_key_index=True)
+
+    def compact(self):
+        """Drop the entries removed with `remove_from_corpus()` from the corpus for good.
+        The remaining entries are renumbered consecutively, keeping their order.
+
+        :return: An array holding, for each new id, the id the entry had before compacting.
+        """
+        if self.corpus_removed is None:
+            return np.arange(len(self.corpus))
+        kept_ids = np.flatnonzero(~self.corpus_removed)
+        new_ids = np.cumsum(~self.corpus_removed) - 1
+        corpus_vect = self.corpus_vect
+        self.corpus_vect = csr_matrix(
+            (corpus_vect.data, new_ids[corpus_vect.indices], corpus_vect.indptr),
+            shape=(corpus_vect.shape[0], len(kept_ids)))
+        self.corpus = [self.corpus[i] for i in kept_ids.tolist()]
+        self.corpus_removed = None
+        self._corpus_changed()
+        return kept_ids
+
+    def refit_idf(self):
+        """Recalculate the inverse document frequency of n-grams from the current corpus
+        (ignoring removed entries) and reweight the corpus matrix accordingly, without
+        vectorizing the corpus again. Strings matched afterwards use the new weights.
+
+        The vocabulary is not changed, n-grams which only occur in strings added with
+        `extend_corpus()` remain unknown. Use `add_corpus()` to rebuild the vocabulary.
+        """
+        if self.corpus_vect is None:
+            raise Exception("Must add a corpus before refitting the IDF-weights to it.")
+        corpus_vect = self.corpus_vect
+        n_terms, n_docs = corpus_vect.shape
+        if self.corpus_removed is not None:
+            n_docs -= int(self.corpus_removed.sum())
+        doc_freq = np.diff(corpus_vect.indptr)
+        old_idf = self._tfidf().idf_
+        # same smoothed IDF as sklearn's TfidfTransformer
+        new_idf = np.log((1 + n_docs) / (1 + doc_freq)) + 1
+
+        # the stored weights are l2-normalized tf * idf -- swap the IDF factor and normalize again
+        terms = np.repeat(np.arange(n_terms), doc_freq)
+        data = corpus_vect.data * (new_idf / old_idf)[terms]
+        norms = np.sqrt(np.bincount(corpus_vect.indices, weights=data**2, minlength=corpus_vect.shape[1]))
+        data /= norms[corpus_vect.indices]
+        self.corpus_vect = csr_matrix((data, corpus_vect.indices, corpus_vect.indptr), shape=corpus_vect.shape)
+        self._tfidf().idf_ = new_idf
+        self._corpus_changed(keep_key_index=True)
+
+    def build_candidate_index(self, idf_quantile=0.5, n_candidates=50):
+        """Build a `CandidateIndex` on the rare n-grams of the corpus for approximate matching
+        with `match_against_corpus(..., approximate=True)`. The index has to be rebuilt after
+        the corpus changed.
+
+        :param idf_quantile: N-grams with an IDF weight of at least this quantile are indexed.
+                             Higher values are faster, but find fewer of the exact matches.
+        :param n_candidates: The number of candidates per lookup that are rescored exactly.
+                             Higher values find more of the exact matches, but are slower.
+        """
+        if self.corpus_vect is None:
+            raise Exception("Must add a corpus before building a candidate index for it.")
+        self.candidate_index = CandidateIndex(self.corpus_vect, self._tfidf().idf_, idf_quantile, n_candidates)
+        # cached approximate results came from the previous index
+        self.result_cache.clear()
 
-    def match_against_corpus(self, strings, top_n=5, threshold=0):
+    def match_against_corpus(self, strings, top_n=5, threshold=0, output="nested", approximate=False):
         """Match a set of strings against the corpus, returning the top n results above the threshold.
 
         :param strings: The strings to match against the corpus.
         :param top_n: The number of potential matches to return for each string.
         :param threshold: Minimum score - all potential matches below this score will be discarded.
+        :param output: "nested" (default) returns one row per string with a list of (score, index, match)
+                       tuples, "long" returns one row per match with columns lookup_idx, match_idx and score,
+                       "arrays" returns the columns of "long" as a tuple of NumPy arrays.
+        :param approximate: If true, only match against the candidates found by the candidate index,
+                            see `build_candidate_index()`.
         """
-        if self.corpus_vect == None:
+        if self.corpus_vect is None:
             raise Exception("Must add a corpus before matching against it.")
+        candidate_index = self._candidate_index(approximate)
+
+        if self.exact_index or self.cache_size > 0:
+            if self.verbose:
+                print("Calculating cosine similarities for lookups not found in the exact match index or cache...")
+            c = self._cached_cossim_top(strings, top_n, threshold, candidate_index)
+            return _format_results(c, strings, self.corpus, output)
 
-        lc_strings = self._to_lowercase(strings)
-        strings_vect = self.vectorizer.transform(lc_strings)
+        strings_vect = self._vectorize(strings)
 
-        return self._match_feature_matrices(strings, self.corpus, strings_vect, self.corpus_vect, top_n, threshold)
+        return self._match_feature_matrices(strings, self.corpus, strings_vect, self.corpus_vect, top_n, threshold,
+                                            output, candidate_index)
 
-    def match_sets(self, left_strings, right_strings, top_n=5, threshold=0):
+    def match_stream(self, strings, batch_size=10000, top_n=5, threshold=0, output="nested", approximate=False):
+        """Match a stream of strings against the corpus batch by batch, yielding one result per batch.
+
+        Strings are pulled lazily from `strings` (e.g. a file, a CSV reader or a database cursor),
+        so memory is bounded by `batch_size` rather than by the total number of strings.
+        Lookup indices in the results are positions within the whole stream.
+
+        :param strings: An iterable of strings to match against the corpus.
+        :param batch_size: The number of strings to vectorize and match at a time.
+        :param top_n: The number of potential matches to return for each string.
+        :param threshold: Minimum score - all potential matches below this score will be discarded.
+        :param output: "nested" (default), "long" or "arrays", see `match_against_corpus()`.
+        :param approximate: If true, use the candidate index, see `match_against_corpus()`.
+        """
+        if self.corpus_vect is None:
+            raise Exception("Must add a corpus before matching against it.")
+        candidate_index = self._candidate_index(approximate)
+
+        strings = iter(strings)
+        offset = 0
+        while True:
+            batch = list(islice(strings, batch_size))
+            if not batch:
+                return
+            if self.verbose:
+                print(f"Matching strings {offset} to {offset + len(batch) - 1}...")
+            if self.exact_index or self.cache_size > 0:
+                c = self._cached_cossim_top(batch, top_n, threshold, candidate_index)
+            else:
+                c = self._cossim_top(self._vectorize(batch), self.corpus_vect, top_n, threshold, candidate_index)
+            yield _format_results(c, batch, self.corpus, output, offset)
+            offset += len(batch)
+
+    def match_sets(self, left_strings, right_strings, top_n=5, threshold=0, output="nested"):
         """Match the set `left_strings` against the set `right_strings`,
         returning for each string in `left_strings` the `top_n` matches in `right_strings`
         with score greater than `threshold`.
@@ -141,18 +712,65 @@ class FuzzyMatcher:
         :param right_strings: The strings that `left_strings` will be matched against.
         :param top_n: The number of potential matches to return for each string.
         :param threshold: Minimum score - all potential matches below this score will be discarded.
+        :param output: "nested" (default), "long" or "arrays", see `match_against_corpus()`.
         """
         if self.is_fitted == False:
             raise Exception(
                 "Must fit a dictionary for IDF-weights before matching. Use `.fit()`.")
 
-        lc_left_strings = self._to_lowercase(left_strings)
-        lc_right_strings = self._to_lowercase(right_strings)
+        left_vect = self._vectorize(left_strings)
+        right_vect = self._vectorize(right_strings).transpose()
+
+        return self._match_feature_matrices(left_strings, right_strings, left_vect, right_vect, top_n, threshold,
+                                            output)
+
+    def deduplicate(self, strings, threshold=0.8, top_n=10, return_pairs=False):
+        """Find groups of near-duplicate strings within one set of strings.
 
-        left_vect = self.vectorizer.transform(lc_left_strings)
-        right_vect = self.vectorizer.transform(lc_right_strings).transpose()
+        The strings are vectorized once and matched against themselves. Identity matches are
+        skipped and mirrored pairs are only kept once. The resulting similarity graph is split into
+        connected components, which are the clusters of duplicates.
+        If `fit()` hasn't been called yet, the inverse document frequency is calculated from `strings`.
+
+        :param strings: The strings to deduplicate.
+        :param threshold: Minimum score for two strings to be considered duplicates.
+        :param top_n: The number of potential duplicates to consider for each string.
+        :param return_pairs: If true, also return the duplicate pairs.
+
+        :return: A DataFrame with columns 'string' and 'cluster', one row per string. Strings without
+                 duplicates get a cluster of their own. If `return_pairs` is true, additionally a DataFrame
+                 with columns left_idx, right_idx (left_idx < right_idx) and score.
+        """
+        normalized = self._normalize(strings)
+        if self.is_fitted == False:
+            if self.verbose:
+                print("Fitting vectorizer to strings...")
+            strings_vect = self.vectorizer.fit_transform(normalized).tocsr()
+            self.is_fitted = True
+        else:
+            strings_vect = self.vectorizer.transform(normalized).tocsr()
+        n = strings_vect.shape[0]
 
-        return self._match_feature_matrices(left_strings, right_strings, left_vect, right_vect, top_n, threshold)
+        if self.verbose:
+            print("Calculating cosine similarities...this might take a while...")
+        # each string finds itself, so ask for one more result
+        c = self._cossim_top(strings_vect, strings_vect.transpose().tocsr(), top_n + 1, threshold)
+
+        rows = np.repeat(np.arange(n), np.diff(c.indptr))
+        cols = c.indices
+        not_identity = rows != cols
+        left = np.minimum(rows, cols)[not_identity]
+        right = np.maximum(rows, cols)[not_identity]
+        scores = c.data[not_identity]
+        _, first = np.unique(left.astype(np.int64) * n + right, return_index=True)
+        left, right, scores = left[first], right[first], scores[first]
+
+        graph = csr_matrix((np.ones(len(left)), (left, right)), shape=(n, n))
+        _, clusters = connected_components(graph, directed=False)
+        result = pd.DataFrame({'string': list(strings), 'cluster': clusters})
+        if return_pairs:
+            return result, pd.DataFrame({'left_idx': left, 'right_idx': right, 'score': scores})
+        return result
 
     def score_pair(self, left_string, right_string):
         """Calculate the matching score for two strings.
@@ -164,69 +782,226 @@ class FuzzyMatcher:
             raise Exception(
                 "Must fit a dictionary for IDF-weights before matching. Use `.fit()`.")
 
-        lc_left_string = left_string.lower()
-        lc_right_string = right_string.lower()
-
-        left_vect = self.vectorizer.transform([lc_left_string])
-        right_vect = self.vectorizer.transform([lc_right_string]).transpose()
+        return self.score_pairs([left_string], [right_string])[0]
 
-        return np.multiply(left_vect, right_vect)[0,0]
+    def score_pairs(self, left_strings, right_strings, chunk_size=None):
+        """Calculate the matching scores of aligned pairs of strings, e.g. candidate pairs from a blocker.
+        Each side is vectorized once (per chunk) and all scores are calculated in one sparse operation.
 
-    def _to_lowercase(self, strings):
-        return [s.lower() for s in strings]
+        :param left_strings: A sequence of strings.
+        :param right_strings: A sequence of strings of the same length as `left_strings`.
+        :param chunk_size: If set, the pairs are scored in chunks of this size to bound memory.
 
-    def _match_feature_matrices(self, left_strings, right_strings, left_vect, right_vect, top_n, threshold):
+        :return: A NumPy array with the score of `left_strings[i]` and `right_strings[i]` at position `i`.
+        """
+        if self.is_fitted == False:
+            raise Exception(
+                "Must fit a dictionary for IDF-weights before matching. Use `.fit()`.")
+        if len(left_strings) != len(right_strings):
+            raise ValueError(
+                f"Got {len(left_strings)} left strings but {len(right_strings)} right strings, must be pairs.")
+
+        chunk_size = chunk_size or max(len(left_strings), 1)
+        scores = [
+            _rowwise_dot(self._vectorize(left_strings[start:start+chunk_size]),
+                         self._vectorize(right_strings[start:start+chunk_size]))
+            for start in range(0, len(left_strings), chunk_size)]
+        return np.concatenate([np.zeros(0)] + scores)
+
+    def _corpus_changed(self, keep_key_index=False):
+        # the candidate index and the cached results are outdated now
+        self.candidate_index = None
+        self.result_cache.clear()
+        if not keep_key_index:
+            self.key_index = None
+            if self.exact_index and self.corpus is not None:
+                self.key_index = {}
+                n_corpus = self.corpus_vect.shape[1]
+                self._index_keys(self.corpus, np.bincount(self.corpus_vect.indices, minlength=n_corpus) > 0)
+
+    def _index_keys(self, strings, has_features, first_id=0):
+        # strings without any known n-gram have an empty vector and never match, so they aren't indexed
+        sub = _STRIP_RE.sub
+        for i, (string, indexed) in enumerate(zip(strings, has_features.tolist()), start=first_id):
+            if self.corpus_removed is not None and i < len(self.corpus_removed) and self.corpus_removed[i]:
+                continue
+            if indexed:
+                self.key_index.setdefault(sub('', string.lower()), []).append(i)
+
+    def _cached_cossim_top(self, strings, top_n, threshold, candidate_index=None):
+        """Like `_cossim_top()` against the corpus, but answers lookups from the exact match index and
+        the result cache first. Only the distinct normalized lookups that miss both are vectorized."""
+        keys = self._normalize(strings)
+        results = [None] * len(keys)
+        misses = {}
+        # exact and approximate results differ, so they are cached separately
+        approximate = candidate_index is not None
+        # exact matches score 1.0, which doesn't pass a threshold of 1 or more
+        use_key_index = self.key_index is not None and threshold < 1
+        for i, key in enumerate(keys):
+            # with fewer than top_n exact matches, the remaining matches need the sparse engine
+            if use_key_index and len(self.key_index.get(key, ())) >= top_n:
+                ids = self.key_index[key][:top_n]
+                results[i] = (np.array(ids, dtype=np.int64), np.ones(len(ids)))
+                self.cache_stats["exact_hits"] += 1
+            elif (key, top_n, threshold, approximate) in self.result_cache:
+                self.result_cache.move_to_end((key, top_n, threshold, approximate))
+                results[i] = self.result_cache[(key, top_n, threshold, approximate)]
+                self.cache_stats["cache_hits"] += 1
+            else:
+                misses.setdefault(key, []).append(i)
+                self.cache_stats["misses"] += 1
+
+        if misses:
+            miss_keys = list(misses)
+            c = self._cossim_top(self.vectorizer.transform(miss_keys), self.corpus_vect, top_n, threshold,
+                                 candidate_index)
+            for j, key in enumerate(miss_keys):
+                result = (c.indices[c.indptr[j]:c.indptr[j+1]].astype(np.int64), c.data[c.indptr[j]:c.indptr[j+1]])
+                for i in misses[key]:
+                    results[i] = result
+                if self.cache_size > 0:
+                    self.result_cache[(key, top_n, threshold, approximate)] = result
+                    if len(self.result_cache) > self.cache_size:
+                        self.result_cache.popitem(last=False)
+
+        counts = np.array([len(ids) for ids, _ in results], dtype=np.int64)
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        indices = np.concatenate([np.zeros(0, dtype=np.int64)] + [ids for ids, _ in results])
+        data = np.concatenate([np.zeros(0)] + [scores for _, scores in results])
+        return csr_matrix((data, indices, indptr), shape=(len(keys), self.corpus_vect.shape[1]))
+
+    def _candidate_index(self, approximate):
+        if not approximate:
+            return None
+        if self.candidate_index is None:
+            raise Exception("Must build a candidate index before approximate matching. Use `.build_candidate_index()`.")
+        return self.candidate_index
+
+    def _cossim_top(self, left_vect, right_vect, top_n, threshold, candidate_index=None):
+        if candidate_index is not None:
+            return candidate_index.match(left_vect, top_n, threshold, n_jobs=self.n_jobs,
+                                         chunk_size=self.chunk_size, pool=self.pool, backend=self.backend)
+        return cossim_top(left_vect, right_vect, top_n, threshold, n_jobs=self.n_jobs,
+                          chunk_size=self.chunk_size, pool=self.pool, backend=self.backend)
+
+    def _preprocessing(self):
+        return {"lowercase": True, "strip_pattern": STRIP_PATTERN}
+
+    def _tfidf(self):
+        """The part of the vectorizer holding the IDF weights."""
+        if self.n_features is None:
+            return self.vectorizer
+        return self.vectorizer.steps[-1][1]
+
+    def _normalize(self, strings):
+        """Lowercase strings and remove the characters in `STRIP_PATTERN` in one pass."""
+        sub = _STRIP_RE.sub
+        return [sub('', s.lower()) for s in strings]
+
+    def _vectorize(self, strings):
+        return self.vectorizer.transform(self._normalize(strings))
+
+    def _match_feature_matrices(self, left_strings, right_strings, left_vect, right_vect, top_n, threshold,
+                                output="nested", candidate_index=None):
         if self.verbose:
             print("Calculating cosine similarities...this might take a while...")
-        c = cossim_top(left_vect, right_vect, top_n, threshold)
+        c = self._cossim_top(left_vect, right_vect, top_n, threshold, candidate_index)
 
         if self.verbose:
             print("Formatting results...")
-
-        non_zeros = c.nonzero()
-
-        sparserows = non_zeros[0]
-        sparsecols = non_zeros[1]
-
-        nr_matches = sparsecols.size
-
-        lookup_indices = []
-        lookups = []
-        results = []
-
-        lookup_index = sparserows[0]
-        lookup = left_strings[sparserows[0]]
-        entry = (c.data[0], sparsecols[0], right_strings[sparsecols[0]])
-        result = [entry]
-
-        for index in range(1, nr_matches):
-            if sparserows[index] != sparserows[index-1]:
-                # new lookup entry - save the previous result list
-                # and create a new result list
-                lookup_indices.append(lookup_index)
-                lookups.append(lookup)
-                results.append(result)
-                lookup_index = sparserows[index]
-                lookup = left_strings[sparserows[index]]
-                result = []
-            entry = (c.data[index], sparsecols[index],
-                     right_strings[sparsecols[index]])
-            result.append(entry)
-
-        lookup_indices.append(lookup_index)
-        lookups.append(lookup)
-        results.append(result)
-
-        # cossim_top only returns indices for which the matching has found a result --
-        # we manually add failed lookups so the output matches the input
-        failed_lookup_indices = [item for item in range(len(left_strings)) if item not in lookup_indices]
-        failed_lookups = [left_strings[i] for i in failed_lookup_indices]
-        failed_results = [[] for i in failed_lookup_indices]
-
-        lookup_indices = lookup_indices + failed_lookup_indices
-        lookups = lookups + failed_lookups
-        results = results + failed_results
-
+        return _format_results(c, left_strings, right_strings, output)
+
+
+class StringBlob:
+    """A read-only sequence of strings stored as UTF-8 bytes plus offsets, see `FuzzyMatcher.load()`.
+
+    String `i` is `blob[offsets[i]:offsets[i+1]]`. Both arrays can be memory-mapped.
+    """
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("StringBlob index out of range")
+        return self.blob[self.offsets[i]:self.offsets[i+1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def _save_strings(directory, name, strings):
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    np.save(os.path.join(directory, f"{name}_offsets.npy"), offsets)
+    with open(os.path.join(directory, f"{name}_blob.bin"), "wb") as f:
+        for e in encoded:
+            f.write(e)
+
+
+def _load_strings(directory, name, mmap_mode=None):
+    offsets = np.load(os.path.join(directory, f"{name}_offsets.npy"), mmap_mode=mmap_mode)
+    blob_file = os.path.join(directory, f"{name}_blob.bin")
+    if offsets[-1] == 0:
+        # numpy can't memory-map empty files
+        blob = np.zeros(0, dtype=np.uint8)
+    elif mmap_mode is None:
+        blob = np.fromfile(blob_file, dtype=np.uint8)
+    else:
+        blob = np.memmap(blob_file, dtype=np.uint8, mode=mmap_mode)
+    return StringBlob(offsets, blob)
+
+
+def _format_results(c, left_strings, right_strings, output="nested", offset=0):
+    """Turn the CSR result of `cossim_top` into a DataFrame.
+
+    Row `i` of `c` holds the matches of `left_strings[i]`, so all lookups -- including the
+    ones without any match (empty rows) -- are addressed through `c.indptr` directly.
+
+    :param c: CSR matrix of scores, shape (len(left_strings), len(right_strings)).
+    :param left_strings: The lookup strings.
+    :param right_strings: The strings matched against.
+    :param output: "nested" returns one row per lookup with a list of (score, index, match) tuples,
+                   "long" returns one row per match with columns lookup_idx, match_idx and score,
+                   "arrays" returns the columns of "long" as a tuple of NumPy arrays.
+    :param offset: Added to the lookup indices, e.g. the position of a batch within a stream.
+    """
+    indptr = c.indptr
+    counts = np.diff(indptr)
+
+    if output in ("long", "arrays"):
+        lookup_idx = np.repeat(np.arange(offset, offset + len(counts)), counts)
+        if output == "arrays":
+            return lookup_idx, c.indices, c.data
         return pd.DataFrame({
-            'lookup': lookups,
-            'results': results}, index=lookup_indices).sort_index()
+            'lookup_idx': lookup_idx,
+            'match_idx': c.indices,
+            'score': c.data})
+    if output != "nested":
+        raise ValueError(f"Unknown output format '{output}', use 'nested', 'long' or 'arrays'.")
+
+    match_indices = c.indices.tolist()
+    matches = [right_strings[i] for i in match_indices]
+    entries = list(zip(c.data.tolist(), match_indices, matches))
+
+    # cossim_top only stores entries for lookups that found a result --
+    # failed lookups are empty rows and get an empty result list
+    failed = counts == 0
+    starts = indptr[:-1].tolist()
+    ends = indptr[1:].tolist()
+    results = [[] if f else entries[s:e] for f, s, e in zip(failed.tolist(), starts, ends)]
+
+    return pd.DataFrame({
+        'lookup': list(left_strings),
+        'results': results}, index=pd.RangeIndex(offset, offset + len(counts)))
@@ -1,53 +1,165 @@
 """Some data cleansing helpers: categorical features, NaN values, datetime
 """
+import warnings
+import numpy as np
 import pandas as pd
-from fintulib import common
+
+
+def _union_levels(columns):
+    """Find the levels of one or more columns in a single vectorized pass.
+    Categorical columns contribute their categories, other columns their unique values.
+    Levels are sorted (or kept in order of first appearance if they can't be compared),
+    so the result doesn't depend on hashing order.
+
+    :return: The levels without NaN as a pd.Index, and whether any column contains NaN.
+    """
+    levels = []
+    has_nan = False
+    for column in columns:
+        if column.dtype.name == 'category':
+            levels.append(column.cat.categories)
+            has_nan = has_nan or bool((column.cat.codes == -1).any())
+        else:
+            uniques = pd.Index(pd.unique(column))
+            levels.append(uniques.dropna())
+            has_nan = has_nan or bool(uniques.hasnans)
+    levels = levels[0].append(levels[1:]).unique()
+    try:
+        levels = levels.sort_values()
+    except TypeError:
+        pass
+    return levels, has_nan
 
 
 def cast_columns_categorical(dfs, col_categorical=[]):
     """Convert columns to categorical, considering their levels across many dataframes.
     Dataframes passed to this function are modified in place.
+    Levels are sorted, so the categories (and codes) are the same across runs. Columns which
+    are categorical already are recoded to the common levels without rebuilding them from values.
 
     :param dfs: a list of pd.DataFrames
     :param col_categorical: a list of column names
     """
     for cat in col_categorical:
         # find all levels across dataframes
-        cat_levels = [df[cat].unique().tolist() for df in dfs if cat in df]
-        cat_levels = list(set(common.lists.flatten_list(cat_levels)))
+        columns = [df[cat] for df in dfs if cat in df]
+        if not columns:
+            continue
+        cat_levels, _ = _union_levels(columns)
         for df in dfs:
             if cat in df:
-                df[cat] = pd.Categorical(df[cat], categories=cat_levels)
+                if df[cat].dtype.name == 'category':
+                    df[cat] = df[cat].cat.set_categories(cat_levels)
+                else:
+                    df[cat] = pd.Categorical(df[cat], categories=cat_levels)
 
 
 def fill_na(df, col_to_fill=[],
             fill_value='NA_FILL_STRING',
-            strings_consider_na=['nan', 'NaN', 'NA', 'N/A']):
+            strings_consider_na=['nan', 'NaN', 'NA', 'N/A'],
+            numeric_fill_value=None):
     """Fill NaN values in given non-numeric columns with given string value.
     Modifies the passed dataframe in place.
 
+    Categorical columns get `fill_value` added as a category (once) and NaN values as well as
+    categories listed in `strings_consider_na` are replaced by it. String columns (object or pandas
+    string dtypes, including Arrow-backed ones) are normalized in one vectorized `isin` pass each.
+
     :param df: DataFrame
     :param col_to_fill: list of column names to fill
+    :param fill_value: the value to fill in non-numeric columns
     :param strings_consider_na: consider these strings to be nan and replace them as  well
+    :param numeric_fill_value: the value to fill NaN in numeric columns with. If not given, numeric
+                               columns are left unchanged with a warning.
+
+    :return: A pd.Series with the number of replaced values per column.
     """
+    counts = {}
     for col in col_to_fill:
-        if df[col].dtype.name == 'category':
-            # need to add our NAN value as a categroy level before filling
-            df[col].cat.add_categories([fill_value])
-            df[col].fillna(fill_value, inplace=True)
-        elif df[col].dtype.name == 'object':
-            # non-numeric columns -- there must be a cleaner way to find string columns
-            df.loc[df[col].isin(strings_consider_na), col] = fill_value
-
-
-def cast_columns_date(df, col_date=[]):
+        df[col], counts[col] = _fill_na_column(df[col], fill_value, strings_consider_na, numeric_fill_value)
+    return pd.Series(counts, dtype=np.int64)
+
+
+def _fill_na_column(column, fill_value, strings_consider_na, numeric_fill_value=None):
+    """Fill NaN values of one column, see `fill_na()`. Returns the filled column and the number of replaced values."""
+    if column.dtype.name == 'category':
+        categories = column.cat.categories
+        na_categories = categories.isin(strings_consider_na)
+        # a code of -1 is NaN -- look up the NaN-like categories once and index with the codes
+        mask = np.append(na_categories, True)[column.cat.codes.to_numpy()]
+        if not mask.any():
+            return column, 0
+        if fill_value not in categories:
+            column = column.cat.add_categories([fill_value])
+        codes = np.where(mask, column.cat.categories.get_loc(fill_value), column.cat.codes.to_numpy())
+        filled = pd.Categorical.from_codes(codes, dtype=column.dtype)
+        return pd.Series(filled, index=column.index, name=column.name), int(mask.sum())
+    if pd.api.types.is_numeric_dtype(column) or pd.api.types.is_datetime64_any_dtype(column):
+        mask = column.isna()
+        if numeric_fill_value is None:
+            if mask.any():
+                warnings.warn(f"Column '{column.name}' is not a string column, pass numeric_fill_value to fill it.")
+            return column, 0
+        return column.fillna(numeric_fill_value), int(mask.sum())
+    # object and string columns
+    mask = column.isna() | column.isin(strings_consider_na)
+    if not mask.any():
+        return column, 0
+    return column.mask(mask, fill_value), int(mask.sum())
+
+
+def cast_columns_date(df, col_date=[], format=None):
     """Convert given column names to datetime
     Modifies the passed dataframe in place.
 
+    Each distinct value of a column is parsed only once and mapped back to the rows, which is much
+    faster than parsing every row if dates repeat. With a `format`, the distinct values of all columns
+    are parsed together.
+
     :param df: The Pandas DataFrame to apply the transformation to
-    :param col_date: The columns with date values
+    :param col_date: The column or list of columns with date values
+    :param format: The strftime format of the dates, e.g. '%Y-%m-%d'. If not given, pandas infers it
+                   for each column.
     """
-    df[col_date] = df[col_date].apply(pd.to_datetime)
+    if isinstance(col_date, str):
+        col_date = [col_date]
+    for col, dates in zip(col_date, _to_datetime_columns([df[col] for col in col_date], format)):
+        df[col] = dates
+
+
+def _to_datetime_columns(columns, format=None):
+    """Convert columns to datetime, parsing the distinct values of each column once. The values of all
+    columns are parsed together if a format is given, otherwise each column gets its own inferred format."""
+    results = [column if pd.api.types.is_datetime64_any_dtype(column) else None for column in columns]
+    factorized = {i: _factorize(column) for i, column in enumerate(columns) if results[i] is None}
+    if format is None:
+        for i, (codes, uniques) in factorized.items():
+            results[i] = _take_parsed(columns[i], codes, pd.to_datetime(uniques))
+    elif factorized:
+        all_uniques = [uniques for _, uniques in factorized.values()]
+        all_uniques = all_uniques[0].append(all_uniques[1:]).unique()
+        parsed = pd.DatetimeIndex(pd.to_datetime(all_uniques, format=format))
+        for i, (codes, uniques) in factorized.items():
+            results[i] = _take_parsed(columns[i], all_uniques.get_indexer(uniques), parsed, codes)
+    return results
+
+
+def _factorize(column):
+    """Codes (-1 for missing values) and distinct values of a column."""
+    if column.dtype.name == 'category':
+        return column.cat.codes.to_numpy(), column.cat.categories
+    codes, uniques = pd.factorize(column)
+    return codes, pd.Index(uniques)
+
+
+def _take_parsed(column, codes, parsed, outer_codes=None):
+    """Map parsed distinct values back to the rows of `column`, missing values (code -1) to NaT."""
+    # append NaT for the code -1 of missing values
+    parsed = pd.DatetimeIndex(parsed).append(pd.DatetimeIndex([pd.NaT]))
+    codes = np.where(codes == -1, len(parsed) - 1, codes)
+    if outer_codes is not None:
+        codes = np.append(codes, len(parsed) - 1)[outer_codes]
+    return pd.Series(parsed.take(codes), index=column.index, name=column.name)
 
 
 def extract_ymd(df, col_name):
@@ -60,12 +172,17 @@ def extract_ymd(df, col_name):
     :param col_date: The column containing the date value -- must be of type datetime
     """
     df_res = df.copy()
-    df_res[col_name+"_year"] = df_res[col_name].dt.year
-    df_res[col_name+"_month"] = df_res[col_name].dt.month
-    df_res[col_name+"_day"] = df_res[col_name].dt.day
+    for name, column in _ymd_columns(df_res[col_name], col_name).items():
+        df_res[name] = column
     return df_res.drop(columns=[col_name])
 
 
+def _ymd_columns(dates, col_name):
+    return {col_name+"_year": dates.dt.year,
+            col_name+"_month": dates.dt.month,
+            col_name+"_day": dates.dt.day}
+
+
 def combine_ymd(df, col_name_date, col_name_year=None, col_name_month=None, col_name_day=None):
     """Combine year, month and date columns to a single column.
 
@@ -78,54 +195,129 @@ def combine_ymd(df, col_name_date, col_name_year=None, col_name_month=None, col_
     :param col_name_day: The name of the column containing the day
     """
     result = df.copy()
+    col_name_year, col_name_month, col_name_day = _ymd_column_names(
+        col_name_date, col_name_year, col_name_month, col_name_day)
+    result[col_name_date] = _combine_ymd_column(df[col_name_year], df[col_name_month], df[col_name_day])
+    return result
+
+
+def _ymd_column_names(col_name_date, col_name_year=None, col_name_month=None, col_name_day=None):
     if (col_name_year == None):
         col_name_year = col_name_date + "_year"
     if (col_name_month == None):
         col_name_month = col_name_date + "_month"
     if (col_name_day == None):
         col_name_day = col_name_date + "_day"
-
-    result[col_name_date] = pd.to_datetime(
-        df[col_name_year]*10000+df[col_name_month]*100+df[col_name_day], format='%Y%m%d')
-    return result
+    return col_name_year, col_name_month, col_name_day
+
+
+def _combine_ymd_column(year, month, day):
+    # nullable extension dtypes (e.g. Int64 with NA) go through the parsing path, which maps NA to NaT
+    if not all(isinstance(column.dtype, np.dtype) and column.dtype.kind in 'iu' for column in (year, month, day)):
+        return pd.to_datetime(year*10000+month*100+day, format='%Y%m%d')
+    # build datetime64 values directly from the integers instead of parsing '%Y%m%d' strings
+    index = year.index
+    year, month, day = [column.to_numpy(dtype=np.int64) for column in (year, month, day)]
+    months = (year - 1970).astype('datetime64[Y]') + (month - 1).astype('timedelta64[M]')
+    dates = months.astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+    invalid = (month < 1) | (month > 12) | (day < 1) | (dates.astype('datetime64[M]') != months)
+    if invalid.any():
+        i = np.flatnonzero(invalid)[0]
+        raise ValueError(f"Invalid date: year {year[i]}, month {month[i]}, day {day[i]}")
+    # datetime64[ns] covers the years 1677 to 2262 only, astype would wrap dates outside silently
+    out_of_bounds = ((year < 1677) | (year > 2262) | (dates < np.datetime64(pd.Timestamp.min.ceil('D'), 'D'))
+                     | (dates > np.datetime64(pd.Timestamp.max.floor('D'), 'D')))
+    if out_of_bounds.any():
+        i = np.flatnonzero(out_of_bounds)[0]
+        raise pd.errors.OutOfBoundsDatetime(f"Out of bounds date: year {year[i]}, month {month[i]}, day {day[i]}")
+    return pd.Series(dates.astype('datetime64[ns]'), index=index)
 
 
 class Mapping:
     """A mapping between categorical string variables and integer variables.
     (similar to sklearn LabelEncoder, but with some helper functions for
     Pandas DataFrames)
+
+    Categories are mapped to 1, 2, ... in the order given. Encoding and decoding are single
+    vectorized lookups (`pd.Index.get_indexer`) instead of one Python call per row.
     """
-    def __init__(self, name, data):
+    def __init__(self, name, data, unknown="raise", unknown_value=0):
+        """Create a mapping.
+
+        :param name: The default column name to apply the mapping to.
+        :param data: The categories, in the order of their integer values.
+        :param unknown: What to do with values that aren't part of the mapping: "raise" raises a KeyError,
+                        "nan" maps them to NaN and "value" maps them to `unknown_value`.
+        :param unknown_value: The value unknown values are mapped to if `unknown` is "value".
+        """
+        if unknown not in ("raise", "nan", "value"):
+            raise ValueError(f"Unknown policy '{unknown}', use 'raise', 'nan' or 'value'.")
         self.name = name
-        mymap = {}
-        i = 1
-        for cat in data:
-            mymap[cat] = i
-            i = i+1
-        self.map = mymap
-        self.invmap = {v: k for k, v in mymap.items()}
-
-    def apply(self, df, col_name=None):
+        self.unknown = unknown
+        self.unknown_value = unknown_value
+        # a category listed more than once gets the integer of its last entry
+        self.map = {category: i for i, category in enumerate(data, start=1)}
+        self.invmap = {v: k for k, v in self.map.items()}
+        self._index_map()
+
+    def __setstate__(self, state):
+        # mappings pickled by older versions only have the dicts
+        self.__dict__.update(state)
+        self.__dict__.setdefault("unknown", "raise")
+        self.__dict__.setdefault("unknown_value", 0)
+        self._index_map()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["categories"], state["codes"]
+        return state
+
+    def _index_map(self):
+        self.categories = pd.Index(list(self.map.keys()))
+        self.codes = pd.Index(list(self.map.values()))
+
+    def apply(self, df, col_name=None, inplace=False):
         """Apply the mapping to a dataframe.
         Note that if 'col_name' is not specified, the original col_name is used.
 
-        Doesn't mutate the original dataframe but returns a new dataframe.
+        Doesn't mutate the original dataframe but returns a new dataframe, unless `inplace` is true.
         """
-        return self._apply(self.map, df, col_name)
+        return self._apply(self.categories, self.codes, df, col_name, inplace)
 
-    def apply_inverse(self, df, col_name=None):
+    def apply_inverse(self, df, col_name=None, inplace=False):
         """Apply the inverse mapping to a dataframe, restoring original content.
         Note that if 'col_name' is not specified, the original col_name is used.
 
-        Doesn't mutate the original dataframe but returns a new dataframe.
+        Doesn't mutate the original dataframe but returns a new dataframe, unless `inplace` is true.
         """
-        return self._apply(self.invmap, df, col_name)
+        return self._apply(self.codes, self.categories, df, col_name, inplace)
 
-    def _apply(self, mapping, df, col_name=None):
+    def _apply(self, keys, values, df, col_name=None, inplace=False):
         if col_name == None:
             col_name = self.name
-        result = df.copy()
-        result[col_name] = result[col_name].apply(lambda x: mapping[x])
+        column = df[col_name]
+        if column.dtype.name == 'category':
+            # look up the categories once and index with the codes -- NaN has code -1
+            positions = keys.get_indexer(column.cat.categories.append(pd.Index([np.nan])))
+            positions = positions[column.cat.codes.to_numpy()]
+        else:
+            positions = keys.get_indexer(column)
+            if keys.hasnans:
+                # get_indexer matches NaN only, map every missing value (None, NaT, pd.NA) to it
+                missing = column.isna().to_numpy()
+                positions[missing] = keys.get_indexer(pd.Index([np.nan]))[0]
+        unknown = positions == -1
+        if unknown.any():
+            if self.unknown == "raise":
+                raise KeyError(
+                    f"Values not in the mapping of '{self.name}': {column[unknown].unique()[:10].tolist()}")
+            fill = np.nan if self.unknown == "nan" else self.unknown_value
+            taken = np.asarray(values.take(np.where(unknown, 0, positions)))
+            mapped = pd.Series(np.where(unknown, fill, taken), index=column.index)
+        else:
+            mapped = pd.Series(values.take(positions), index=column.index)
+        result = df if inplace else df.copy()
+        result[col_name] = mapped
         return result
 
 
@@ -133,12 +325,13 @@ def create_integer_mapping(dfs, col_name):
     """Create a mapping to integers for categorical string variables.
     Works with one or more dataframes.
     Returns the mapping and reverse mapping.
+    Categories are sorted, NaN (if present) is mapped to the last integer.
     """
-    if type(dfs) is list:
-        categories_sets = [set(df[col_name].unique().tolist()) for df in dfs]
-        categories = set.union(*categories_sets)
-    else:
-        categories = dfs[col_name].unique()
+    if type(dfs) is not list:
+        dfs = [dfs]
+    categories, has_nan = _union_levels([df[col_name] for df in dfs])
+    if has_nan:
+        categories = categories.append(pd.Index([np.nan]))
     return Mapping(col_name, categories)
 
 
@@ -147,7 +340,7 @@ def add_separate_value(df, col_name):
 
     Doesn't mutate the original dataframe but returns a new dataframe.
     """
-    newval = df[col_name].max() + (df[col_name].max()-df[col_name].min()) + 1
+    newval = _separate_value([df[col_name]])
     result = df.copy()
     result[col_name] = df[col_name].fillna(newval)
     return result, newval
@@ -161,3 +354,194 @@ def fillna_column(df, col_name, val):
     result = df.copy()
     result[col_name] = result[col_name].fillna(val)
     return result
+
+
+def _separate_value(columns):
+    """A value greater than all values of the given columns by more than their range."""
+    col_max = max(column.max() for column in columns)
+    col_min = min(column.min() for column in columns)
+    return col_max + (col_max-col_min) + 1
+
+
+class Pipeline:
+    """A reusable sequence of cleaning operations that is executed with at most one copy of the data.
+
+    Operations are recorded by calling the methods named like the functions of this module, e.g.
+    `Pipeline().extract_ymd("date").fillna_column("amount", 0).cast_categorical(["shop"])`.
+    `transform()` makes one copy of the DataFrame (or none with `inplace=True`). The operations
+    work on columns only: a column touched by several operations is passed from one to the next
+    as a Series and written to the DataFrame once at the end, dropped columns are dropped once.
+
+    Operations with state -- the levels of `cast_categorical` and the separate value of
+    `add_separate_value` -- learn it from all DataFrames passed to `fit()`, so train and score
+    frames are transformed alike. Without `fit()`, the state is computed from each transformed frame.
+    """
+
+    def __init__(self):
+        self.steps = []
+        self.state = {}
+        self.is_fitted = False
+
+    def fill_na(self, col_to_fill, fill_value='NA_FILL_STRING', strings_consider_na=['nan', 'NaN', 'NA', 'N/A'],
+                numeric_fill_value=None):
+        """Fill NaN values and NaN-like strings in the given columns, see `fill_na()`."""
+        return self._add_step("fill_na", col_to_fill=list(col_to_fill), fill_value=fill_value,
+                              strings_consider_na=list(strings_consider_na), numeric_fill_value=numeric_fill_value)
+
+    def extract_ymd(self, col_name):
+        """Extract year, month and date from column 'col_name' and drop 'col_name', see `extract_ymd()`."""
+        return self._add_step("extract_ymd", col_name=col_name)
+
+    def combine_ymd(self, col_name_date, col_name_year=None, col_name_month=None, col_name_day=None):
+        """Combine year, month and date columns to a single column, see `combine_ymd()`."""
+        return self._add_step("combine_ymd", col_name_date=col_name_date, col_names=_ymd_column_names(
+            col_name_date, col_name_year, col_name_month, col_name_day))
+
+    def fillna_column(self, col_name, val):
+        """Replace all N/As in a given column with a given value, see `fillna_column()`."""
+        return self._add_step("fillna_column", col_name=col_name, val=val)
+
+    def add_separate_value(self, col_name):
+        """Replace all N/As in a numerical column with a truly separate value, see `add_separate_value()`.
+        After `fit()`, the value is available in `state`."""
+        return self._add_step("add_separate_value", col_name=col_name)
+
+    def cast_categorical(self, col_categorical):
+        """Convert columns to categorical with common levels, see `cast_columns_categorical()`."""
+        return self._add_step("cast_categorical", col_categorical=list(col_categorical))
+
+    def cast_date(self, col_date, format=None):
+        """Convert columns to datetime, see `cast_columns_date()`."""
+        if isinstance(col_date, str):
+            col_date = [col_date]
+        return self._add_step("cast_date", col_date=list(col_date), format=format)
+
+    def apply_mapping(self, mapping, col_name=None, inverse=False):
+        """Apply a `Mapping` (or its inverse) to a column."""
+        return self._add_step("apply_mapping", mapping=mapping, col_name=col_name or mapping.name, inverse=inverse)
+
+    def fit(self, dfs):
+        """Learn the state of the operations (categorical levels, separate values) from one or more
+        DataFrames. The DataFrames are not modified.
+
+        :param dfs: A DataFrame or a list of DataFrames, e.g. the train and score frames.
+        """
+        if type(dfs) is not list:
+            dfs = [dfs]
+        self.state = {}
+        columns_list = [_Columns(df) for df in dfs]
+        for i, (operation, params) in enumerate(self.steps):
+            self.state[i] = self._fit_step(operation, params, columns_list)
+            for columns in columns_list:
+                self._apply_step(operation, params, self.state[i], columns)
+        self.is_fitted = True
+        return self
+
+    def transform(self, df, inplace=False):
+        """Apply all operations to a DataFrame.
+
+        :param df: The DataFrame to transform.
+        :param inplace: If true, modify `df` instead of copying it.
+        :return: The transformed DataFrame.
+        """
+        columns = _Columns(df)
+        for i, (operation, params) in enumerate(self.steps):
+            state = self.state[i] if self.is_fitted else self._fit_step(operation, params, [columns])
+            self._apply_step(operation, params, state, columns)
+        result = df if inplace else df.copy()
+        columns.write_to(result)
+        return result
+
+    def fit_transform(self, dfs, inplace=False):
+        """Fit the pipeline to one or more DataFrames and transform them.
+
+        :return: The transformed DataFrame, or a list of them if `dfs` is a list.
+        """
+        self.fit(dfs)
+        if type(dfs) is not list:
+            return self.transform(dfs, inplace)
+        return [self.transform(df, inplace) for df in dfs]
+
+    def _add_step(self, operation, **params):
+        self.steps.append((operation, params))
+        self.is_fitted = False
+        return self
+
+    def _fit_step(self, operation, params, columns_list):
+        if operation == "add_separate_value":
+            return _separate_value([columns[params["col_name"]] for columns in columns_list])
+        if operation == "cast_categorical":
+            return {cat: _union_levels([columns[cat] for columns in columns_list if cat in columns])[0]
+                    for cat in params["col_categorical"]
+                    if any(cat in columns for columns in columns_list)}
+        return None
+
+    def _apply_step(self, operation, params, state, columns):
+        if operation == "fill_na":
+            for col in params["col_to_fill"]:
+                columns[col], _ = _fill_na_column(columns[col], params["fill_value"], params["strings_consider_na"],
+                                                  params["numeric_fill_value"])
+        elif operation == "extract_ymd":
+            col_name = params["col_name"]
+            for name, column in _ymd_columns(columns[col_name], col_name).items():
+                columns[name] = column
+            del columns[col_name]
+        elif operation == "combine_ymd":
+            year, month, day = [columns[name] for name in params["col_names"]]
+            columns[params["col_name_date"]] = _combine_ymd_column(year, month, day)
+        elif operation == "fillna_column":
+            columns[params["col_name"]] = columns[params["col_name"]].fillna(params["val"])
+        elif operation == "add_separate_value":
+            columns[params["col_name"]] = columns[params["col_name"]].fillna(state)
+        elif operation == "cast_categorical":
+            for cat, cat_levels in state.items():
+                if cat in columns:
+                    column = columns[cat]
+                    if column.dtype.name == 'category':
+                        columns[cat] = column.cat.set_categories(cat_levels)
+                    else:
+                        columns[cat] = pd.Series(pd.Categorical(column, categories=cat_levels), index=column.index)
+        elif operation == "cast_date":
+            col_date = params["col_date"]
+            for col, dates in zip(col_date, _to_datetime_columns([columns[col] for col in col_date], params["format"])):
+                columns[col] = dates
+        elif operation == "apply_mapping":
+            mapping, col_name = params["mapping"], params["col_name"]
+            frame = pd.DataFrame({col_name: columns[col_name]})
+            if params["inverse"]:
+                frame = mapping.apply_inverse(frame, col_name, inplace=True)
+            else:
+                frame = mapping.apply(frame, col_name, inplace=True)
+            columns[col_name] = frame[col_name]
+
+
+class _Columns:
+    """The columns of a DataFrame with pending changes, which are only written by `write_to()`."""
+
+    def __init__(self, df):
+        self.df = df
+        self.changed = {}
+        self.dropped = set()
+
+    def __contains__(self, col):
+        return col in self.changed or (col in self.df and col not in self.dropped)
+
+    def __getitem__(self, col):
+        if col in self.changed:
+            return self.changed[col]
+        if col in self.dropped:
+            raise KeyError(col)
+        return self.df[col]
+
+    def __setitem__(self, col, column):
+        self.changed[col] = column
+        self.dropped.discard(col)
+
+    def __delitem__(self, col):
+        self.changed.pop(col, None)
+        self.dropped.add(col)
+
+    def write_to(self, df):
+        for col, column in self.changed.items():
+            df[col] = column
+        df.drop(columns=[col for col in self.dropped if col in df], inplace=True)
@@ -11,7 +11,7 @@ setup(
     packages=find_packages(exclude=['contrib', 'docs', 'tests', '__pycache__']),
     include_package_data=True,
     install_requires=[
-        "google-cloud-storage >= 1.8.0",
+        "google-cloud-storage >= 3.0.0",
         "dill >= 0.2.7.1",
         "numpy >= 1.14.2",
         "pandas >= 0.22.0",
@@ -20,5 +20,11 @@ setup(
         "scipy >= 1.1.0",
         "setuptools >= 39.0.1",
         "statsmodels >= 0.8.0"
-    ]
+    ],
+    extras_require={
+        # fintulib.cloud.gcs: Parquet DataFrames and compressed objects, fintulib.common.pandas: Parquet files
+        "parquet": ["pyarrow >= 1.0.0"],
+        "zstd": ["zstandard >= 0.15.0"],
+        "lz4": ["lz4 >= 2.0.0"]
+    }
 )
@@ -0,0 +1,127 @@
+"""An in-memory stand-in for `google.cloud.storage.Client`, implementing the calls used by
+`fintulib.cloud.gcs` with the same preconditions and errors as Google Cloud Storage.
+"""
+import base64
+import hashlib
+import io
+import threading
+import google_crc32c
+from google.api_core import exceptions
+
+
+class FakeClient:
+    def __init__(self):
+        self.objects = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+        # exceptions raised by the next downloads, one per call
+        self.download_errors = []
+        self.requests = []
+
+    def bucket(self, bucket_name):
+        return FakeBucket(self, bucket_name)
+
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def blob(self, blob_name):
+        return FakeBlob(self, blob_name)
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.generation = None
+        self.size = None
+        self.crc32c = None
+        self.md5_hash = None
+
+    @property
+    def _key(self):
+        return self.bucket.name, self.name
+
+    def _request(self, method):
+        client = self.bucket.client
+        client.requests.append((method, self.name))
+        if method.startswith("download") and client.download_errors:
+            error = client.download_errors.pop(0)
+            if error is not None:
+                raise error
+
+    def _get(self, if_generation_match=None):
+        with self.bucket.client.lock:
+            if self._key not in self.bucket.client.objects:
+                raise exceptions.NotFound(f"{self.name} not found")
+            data, generation = self.bucket.client.objects[self._key]
+        if if_generation_match is not None and generation != if_generation_match:
+            raise exceptions.PreconditionFailed(f"{self.name} has generation {generation}")
+        return data
+
+    def _put(self, data, if_generation_match=None):
+        client = self.bucket.client
+        with client.lock:
+            generation = client.objects.get(self._key, (None, 0))[1]
+            if if_generation_match is not None and generation != if_generation_match:
+                raise exceptions.PreconditionFailed(f"{self.name} has generation {generation}")
+            client.generation += 1
+            client.objects[self._key] = (bytes(data), client.generation)
+
+    def reload(self):
+        self._request("reload")
+        data = self._get()
+        self.generation = self.bucket.client.objects[self._key][1]
+        self.size = len(data)
+        self.crc32c = base64.b64encode(google_crc32c.Checksum(data).digest()).decode("ascii")
+        self.md5_hash = base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+
+    def upload_from_file(self, file_obj, if_generation_match=None):
+        self._request("upload")
+        self._put(file_obj.read(), if_generation_match)
+
+    def upload_from_string(self, data, if_generation_match=None):
+        self._request("upload")
+        self._put(data, if_generation_match)
+
+    def download_to_file(self, file_obj, if_generation_match=None):
+        self._request("download")
+        file_obj.write(self._get(if_generation_match))
+
+    def download_as_bytes(self, start=None, end=None, if_generation_match=None, checksum="md5"):
+        self._request("download_range")
+        data = self._get(if_generation_match)
+        return data[start or 0:None if end is None else end + 1]
+
+    def compose(self, sources, if_generation_match=None):
+        self._request("compose")
+        self._put(b"".join(source._get() for source in sources), if_generation_match)
+
+    def delete(self):
+        self._request("delete")
+        with self.bucket.client.lock:
+            if self.bucket.client.objects.pop(self._key, None) is None:
+                raise exceptions.NotFound(f"{self.name} not found")
+
+    def open(self, mode="rb", ignore_flush=False, if_generation_match=None):
+        if mode == "rb":
+            self._request("download")
+            return io.BytesIO(self._get())
+        return FakeBlobWriter(self, if_generation_match)
+
+
+class FakeBlobWriter(io.BytesIO):
+    """Uploads on close, and like `google.cloud.storage.fileio.BlobWriter` discards the upload if the
+    `with` block raised."""
+    def __init__(self, blob, if_generation_match):
+        super().__init__()
+        self.blob = blob
+        self.if_generation_match = if_generation_match
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.blob._request("upload")
+            self.blob._put(self.getvalue(), self.if_generation_match)
+        self.close()
@@ -0,0 +1,63 @@
+import os
+import pickle
+import numpy as np
+from fintulib.wrangle.FuzzyMatcher import FuzzyMatcher
+
+CORPUS = ["apple inc", "apple incorporated", "banana corp", "cherry gmbh", "pineapple inc", "date ltd"]
+
+
+def fitted_matcher(**kwargs):
+    matcher = FuzzyMatcher(verbose=False, backend="scipy", **kwargs)
+    matcher.fit(CORPUS)
+    matcher.add_corpus(CORPUS)
+    return matcher
+
+
+def test_load_state_of_old_format(tmp_path):
+    # older versions pickled only these attributes, with the transposed corpus matrix as CSC
+    matcher = fitted_matcher()
+    state = {"vectorizer": matcher.vectorizer, "n_grams_n": matcher.n_grams_n, "is_fitted": True,
+             "corpus": list(CORPUS), "corpus_vect": matcher.vectorizer.transform(CORPUS).transpose().tocsc()}
+    with open(tmp_path / "state.pkl", "wb") as f:
+        pickle.dump(state, f)
+
+    loaded = FuzzyMatcher(verbose=False, backend="scipy")
+    loaded.load_state(str(tmp_path / "state.pkl"))
+    expected = matcher.match_against_corpus(["apple inc"], top_n=3, output="long")
+    assert loaded.match_against_corpus(["apple inc"], top_n=3, output="long").equals(expected)
+
+    loaded.remove_from_corpus([0])
+    assert 0 not in loaded.match_against_corpus(["apple inc"], top_n=3, output="long")["match_idx"].tolist()
+    loaded.refit_idf()
+    assert np.array_equal(loaded.compact(), [1, 2, 3, 4, 5])
+    assert loaded.match_against_corpus(["banana corp"], top_n=1, output="long")["match_idx"].tolist() == [1]
+
+
+def test_save_to_loaded_directory(tmp_path):
+    directory = str(tmp_path / "matcher")
+    matcher = fitted_matcher()
+    matcher.save(directory)
+    expected = matcher.match_against_corpus(["apple inc"], top_n=3, output="long")
+
+    loaded = FuzzyMatcher(verbose=False, backend="scipy")
+    loaded.load(directory)
+    loaded.save(directory)
+    reloaded = FuzzyMatcher(verbose=False, backend="scipy")
+    reloaded.load(directory)
+    assert reloaded.match_against_corpus(["apple inc"], top_n=3, output="long").equals(expected)
+    assert loaded.match_against_corpus(["apple inc"], top_n=3, output="long").equals(expected)
+    assert os.listdir(tmp_path) == ["matcher"]
+
+
+def test_exact_index_matches_engine():
+    matcher = fitted_matcher(exact_index=True)
+    plain = fitted_matcher()
+    # "qqqq" has no n-gram of the vocabulary, so its vector is empty and the engine never matches it
+    for m in (matcher, plain):
+        m.extend_corpus(["apple inc", "qqqq"])
+    for threshold in (0, 0.5, 1):
+        for lookups in (["apple inc"], ["qqqq"]):
+            expected = plain.match_against_corpus(lookups, top_n=1, threshold=threshold, output="long")
+            result = matcher.match_against_corpus(lookups, top_n=1, threshold=threshold, output="long")
+            # identical strings tie, so only the scores are compared
+            assert len(result) == len(expected) and np.allclose(result["score"], expected["score"])
@@ -0,0 +1,167 @@
+import os
+import pytest
+from google.api_core import exceptions
+from fintulib.cloud import gcs
+from fake_gcs import FakeClient
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(gcs, "RETRY_BACKOFF", 0.)
+    return FakeClient()
+
+
+def write_files(directory, n, size=100):
+    files = []
+    for i in range(n):
+        file_name = str(directory / f"file{i}")
+        with open(file_name, "wb") as f:
+            f.write(os.urandom(size))
+        files.append((file_name, f"gs://bucket/files/file{i}"))
+    return files
+
+
+def read(file_name):
+    with open(file_name, "rb") as f:
+        return f.read()
+
+
+def test_upload_file_precondition_raises_file_exists(client, tmp_path):
+    (file_name, gcs_path), = write_files(tmp_path, 1)
+    gcs.gcs_upload_file(file_name, gcs_path, verbose=False, client=client)
+    with pytest.raises(FileExistsError):
+        gcs.gcs_upload_file(file_name, gcs_path, verbose=False, client=client)
+    gcs.gcs_upload_file(file_name, gcs_path, overwrite=True, verbose=False, client=client)
+    # the precondition replaces the exists() request
+    assert [method for method, _ in client.requests] == ["upload"] * 3
+
+
+def test_upload_object_precondition_raises_file_exists(client):
+    gcs.gcs_upload_object({"a": 1}, "gs://bucket/object", verbose=False, client=client)
+    with pytest.raises(FileExistsError):
+        gcs.gcs_upload_object({"a": 2}, "gs://bucket/object", verbose=False, client=client)
+    assert gcs.gcs_download_object("gs://bucket/object", verbose=False, client=client) == {"a": 1}
+
+
+def test_download_not_found_removes_partial_file(client, tmp_path):
+    file_name = str(tmp_path / "missing")
+    with pytest.raises(FileNotFoundError):
+        gcs.gcs_download_file("gs://bucket/missing", file_name, verbose=False, client=client)
+    assert not os.path.exists(file_name)
+    with pytest.raises(FileNotFoundError):
+        gcs.gcs_download_object("gs://bucket/missing", verbose=False, client=client)
+
+
+def test_upload_and_download_many(client, tmp_path):
+    files = write_files(tmp_path, 20)
+    gcs.gcs_upload_many(files, verbose=False, client=client)
+    gcs.gcs_download_many([(gcs_path, file_name + ".copy") for file_name, gcs_path in files], verbose=False,
+                          client=client)
+    for file_name, _ in files:
+        assert read(file_name + ".copy") == read(file_name)
+
+
+def test_download_many_retries_transient_errors(client, tmp_path):
+    files = write_files(tmp_path, 2)
+    gcs.gcs_upload_many(files, verbose=False, client=client)
+    client.download_errors = [exceptions.ServiceUnavailable("unavailable"), exceptions.TooManyRequests("slow down")]
+    gcs.gcs_download_many([(gcs_path, file_name + ".copy") for file_name, gcs_path in files], max_workers=1,
+                          retries=2, verbose=False, client=client)
+    assert [method for method, _ in client.requests].count("download") == 4
+    for file_name, _ in files:
+        assert read(file_name + ".copy") == read(file_name)
+
+
+def test_download_gives_up_after_retries(client, tmp_path):
+    (file_name, gcs_path), = write_files(tmp_path, 1)
+    gcs.gcs_upload_file(file_name, gcs_path, verbose=False, client=client)
+    client.download_errors = [exceptions.ServiceUnavailable("unavailable")] * 3
+    with pytest.raises(RuntimeError) as error:
+        gcs.gcs_download_many([(gcs_path, file_name + ".copy")], retries=2, verbose=False, client=client)
+    assert isinstance(error.value.__cause__, exceptions.ServiceUnavailable)
+    assert not os.path.exists(file_name + ".copy")
+
+
+def test_upload_many_aggregates_errors(client, tmp_path):
+    files = write_files(tmp_path, 5)
+    gcs.gcs_upload_many(files[:2], verbose=False, client=client)
+    with pytest.raises(RuntimeError, match="2 of 5 uploads failed") as error:
+        gcs.gcs_upload_many(files, verbose=False, client=client)
+    assert isinstance(error.value.__cause__, FileExistsError)
+    # the other uploads carried on
+    assert len(client.objects) == 5
+
+
+def test_cache_serves_unchanged_objects_from_disk(client, tmp_path):
+    cache = gcs.GCSCache(str(tmp_path / "cache"))
+    gcs.gcs_upload_object([1, 2, 3], "gs://bucket/object", verbose=False, client=client)
+    for _ in range(3):
+        assert gcs.gcs_download_object("gs://bucket/object", verbose=False, client=client, cache=cache) == [1, 2, 3]
+    # one metadata request per lookup, one download in total
+    assert [method for method, _ in client.requests].count("download") == 1
+    assert [method for method, _ in client.requests].count("reload") == 3
+
+    gcs.gcs_upload_object([4], "gs://bucket/object", overwrite=True, verbose=False, client=client)
+    assert gcs.gcs_download_object("gs://bucket/object", verbose=False, client=client, cache=cache) == [4]
+
+    file_name = str(tmp_path / "copy")
+    gcs.gcs_download_file("gs://bucket/object", file_name, verbose=False, client=client, cache=cache)
+    assert read(file_name) == read(cache.fetch("gs://bucket/object", client=client))
+    with pytest.raises(FileNotFoundError):
+        cache.fetch("gs://bucket/missing", client=client)
+
+
+def test_cache_evicts_least_recently_used(client, tmp_path):
+    files = write_files(tmp_path, 3, size=1000)
+    gcs.gcs_upload_many(files, verbose=False, client=client)
+    cache = gcs.GCSCache(str(tmp_path / "cache"), max_size=2500)
+    paths = [cache.fetch(gcs_path, client=client) for _, gcs_path in files]
+    for path, mtime in zip(paths, range(3)):
+        if os.path.exists(path):
+            os.utime(path, (mtime, mtime))
+    cache.fetch(files[1][1], client=client)
+    cache.fetch(files[0][1], client=client)
+    cache.evict()
+    assert [os.path.exists(path) for path in paths] == [True, True, False]
+
+    # entries larger than max_size are still readable once
+    cache.max_size = 10
+    with cache.open(files[2][1], client=client) as f:
+        assert f.read() == read(files[2][0])
+    cache.clear()
+    assert not any(os.path.exists(path) for path in paths)
+
+
+@pytest.mark.parametrize("size", [999, 1000, 40 * 1000 + 1])
+def test_sliced_upload_and_download(client, tmp_path, size):
+    # 41 slices need two levels of compose
+    (file_name, gcs_path), = write_files(tmp_path, 1, size=size)
+    gcs.gcs_upload_file(file_name, gcs_path, verbose=False, client=client, chunk_size=1000, max_workers=4)
+    assert client.objects[("bucket", "files/file0")][0] == read(file_name)
+    # the slices are deleted
+    assert list(client.objects) == [("bucket", "files/file0")]
+    with pytest.raises(FileExistsError):
+        gcs.gcs_upload_file(file_name, gcs_path, verbose=False, client=client, chunk_size=1000)
+    assert list(client.objects) == [("bucket", "files/file0")]
+
+    gcs.gcs_download_file(gcs_path, file_name + ".copy", verbose=False, client=client, chunk_size=300,
+                          max_workers=4)
+    assert read(file_name + ".copy") == read(file_name)
+
+
+def test_sliced_download_checks_integrity(client, tmp_path, monkeypatch):
+    (file_name, gcs_path), = write_files(tmp_path, 1, size=1000)
+    gcs.gcs_upload_file(file_name, gcs_path, verbose=False, client=client)
+    download_as_bytes = type(client.bucket("bucket").blob("any")).download_as_bytes
+
+    def corrupted(blob, start=None, end=None, **kwargs):
+        data = download_as_bytes(blob, start, end, **kwargs)
+        return bytes([data[0] ^ 1]) + data[1:] if start == 300 else data
+
+    monkeypatch.setattr(type(client.bucket("bucket").blob("any")), "download_as_bytes", corrupted)
+    with pytest.raises(IOError, match="checksum"):
+        gcs.gcs_download_file(gcs_path, file_name + ".copy", verbose=False, client=client, chunk_size=300)
+    assert not os.path.exists(file_name + ".copy")
+    with pytest.raises(FileNotFoundError):
+        gcs.gcs_download_file("gs://bucket/missing", file_name + ".copy", verbose=False, client=client,
+                              chunk_size=300)